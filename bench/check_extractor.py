@@ -0,0 +1,204 @@
+"""
+EXTRACTOR EQUIVALENCE CHECK / COMPROBACIÓN DEL EXTRACTOR
+
+process_report() builds the summary and lap metrics with compile_extractor()
+over SUMMARY_FIELDS / LAP_FIELDS, and reads Connect IQ fields through
+ciq_index(). This script keeps the per-field code they replaced and checks
+that both give the same output (same keys, order, values, and the same
+exception when a payload makes the old code raise), for the bundled
+fixtures and for randomised payloads with missing, null and malformed fields.
+
+    python bench/check_extractor.py
+    python bench/check_extractor.py --payloads 20000 --seed 7
+
+Exit code 1 and the first mismatches when the outputs differ.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# main reads its configuration at import time / main lee la configuración al importarse
+_tmp = tempfile.mkdtemp(prefix='garmin-check-')
+os.environ['BOT_DB'] = os.path.join(_tmp, 'check.sqlite3')
+os.environ['GARMIN_TOKENSTORE'] = os.path.join(_tmp, 'tokens')
+os.environ.setdefault('TELEGRAM_TOKEN', 'check')
+
+import fixtures  # noqa: E402
+import main  # noqa: E402
+from main import EF_APP_ID, EF_FIELD_NUM_GLOBAL, EF_FIELD_NUM_LAP, format_pace, safe_round  # noqa: E402
+
+# ------------------------------------------------------------------------------
+# Per-field code replaced by the extractor / Código anterior, campo a campo
+# ------------------------------------------------------------------------------
+
+def legacy_get_ciq_by_id(data, target_app_id, target_field_num):
+    ciq_list = data.get('connectIQMeasurements') or data.get('connectIQMeasurement', [])
+    if not ciq_list: return None
+    for item in ciq_list:
+        app_id = str(item.get('appID', ''))
+        field_num = item.get('developerFieldNumber')
+        try:
+            if app_id == target_app_id and int(field_num) == int(target_field_num):
+                return float(item.get('value'))
+        except: continue
+    return None
+
+
+def legacy_summary(data):
+    s = data.get('summaryDTO', {})
+    metrics = {
+        "distancia": safe_round(s.get("distance", 0), 2),
+        "duracion": s.get("duration", 0),
+        "ritmo_ms": s.get("averageSpeed"),
+        "vel_kmh": safe_round(s.get("averageSpeed", 0) * 3.6, 2),
+        "fc_avg": safe_round(s.get("averageHR", "N/A"), 0),
+        "fc_max": safe_round(s.get("maxHR", "N/A"), 0),
+        "te_aer": safe_round(s.get("trainingEffect", "N/A"), 1),
+        "te_ana": safe_round(s.get("anaerobicTrainingEffect", 0.0), 1),
+        "carga": safe_round(s.get("activityTrainingLoad", "N/A"), 0),
+        "calorias": safe_round(s.get("calories", "N/A"), 0),
+        "cadencia": safe_round(s.get("averageRunCadence", "N/A"), 0),
+        "cadencia_max": safe_round(s.get("maxRunCadence", "N/A"), 0),
+        "zancada": safe_round(s.get("strideLength", "N/A"), 0),
+        "ratio_v": safe_round(s.get("verticalRatio", "N/A"), 1),
+        "osc_v": safe_round(s.get("verticalOscillation", "N/A"), 1),
+        "gct": safe_round(s.get("groundContactTime", "N/A"), 0),
+        "potencia": safe_round(s.get("averagePower", "N/A"), 0),
+        "ascenso": safe_round(s.get("elevationGain", 0), 0),
+        "gap_ms": s.get("avgGradeAdjustedSpeed")
+    }
+    ciq_ef = legacy_get_ciq_by_id(data, EF_APP_ID, EF_FIELD_NUM_GLOBAL)
+    metrics['ef'] = f"{ciq_ef:.2f}" if ciq_ef else "-"
+    return metrics
+
+
+def legacy_lap(split):
+    return {
+        "ritmo": format_pace(split.get("averageSpeed")),
+        "gap": format_pace(split.get("avgGradeAdjustedSpeed")),
+        "fc": safe_round(split.get("averageHR", "-"), 0),
+        "cad": safe_round(split.get("averageRunCadence", "N/A"), 0),
+        "gct": safe_round(split.get("groundContactTime", "N/A"), 0),
+        "ef": f"{legacy_get_ciq_by_id(split, EF_APP_ID, EF_FIELD_NUM_LAP):.2f}" if legacy_get_ciq_by_id(split, EF_APP_ID, EF_FIELD_NUM_LAP) else "-"
+    }
+
+# ------------------------------------------------------------------------------
+# Current code / Código actual
+# ------------------------------------------------------------------------------
+
+def current_summary(data):
+    metrics = main.extract_summary(data.get('summaryDTO', {}))
+    metrics['ef'] = main.format_ef(main.ciq_index(data).get((EF_APP_ID, EF_FIELD_NUM_GLOBAL)))
+    return metrics
+
+
+def current_lap(split):
+    lap = main.extract_lap(split)
+    lap['ef'] = main.format_ef(main.ciq_index(split).get((EF_APP_ID, EF_FIELD_NUM_LAP)))
+    return lap
+
+
+def outcome(func, payload):
+    """repr() of the result (NaN-safe, keeps key order), or the exception type when it raises."""
+    try: return repr(list(func(payload).items()))
+    except Exception as e: return f"raises {type(e).__name__}"
+
+# ------------------------------------------------------------------------------
+# Payloads / Datos de prueba
+# ------------------------------------------------------------------------------
+
+SUMMARY_KEYS = sorted({field for _, field, _, _ in main.SUMMARY_FIELDS})
+LAP_KEYS = sorted({field for _, field, _, _ in main.LAP_FIELDS})
+
+
+def random_value(rng):
+    kind = rng.random()
+    if kind < 0.55: return round(rng.uniform(0, 400), rng.choice([0, 1, 2, 3, 6]))
+    if kind < 0.7: return rng.randint(0, 20000)
+    if kind < 0.8: return None
+    if kind < 0.87: return rng.choice(["", "N/A", "12.5", "abc"])
+    if kind < 0.92: return rng.choice([float('nan'), float('inf'), -0.0, 0])
+    return rng.choice([True, [], {}])
+
+
+def random_ciq(rng):
+    items = []
+    for _ in range(rng.randint(0, 4)):
+        item = {'appID': rng.choice([EF_APP_ID, EF_APP_ID, "other-app", None, 42]),
+                'developerFieldNumber': rng.choice([EF_FIELD_NUM_GLOBAL, EF_FIELD_NUM_LAP, "1", "2", 3, None, "x", 2.0]),
+                'value': rng.choice([rng.uniform(0.5, 2.5), "1.37", None, "bad", 0, 0.0])}
+        for key in list(item):
+            if rng.random() < 0.1: del item[key]
+        items.append(item)
+    return items
+
+
+def random_fields(rng, keys):
+    fields = {key: random_value(rng) for key in keys if rng.random() > 0.2}
+    # A null or text speed makes both versions raise: keep it numeric most of the time
+    if 'averageSpeed' in fields and rng.random() < 0.85: fields['averageSpeed'] = rng.uniform(0.5, 6)
+    return fields
+
+
+def random_activity(rng):
+    data = {'summaryDTO': random_fields(rng, SUMMARY_KEYS)}
+    if rng.random() < 0.2: del data['summaryDTO']
+    ciq_key = rng.choice(['connectIQMeasurements', 'connectIQMeasurement'])
+    if rng.random() < 0.8: data[ciq_key] = random_ciq(rng)
+    return data
+
+
+def random_lap(rng):
+    lap = random_fields(rng, LAP_KEYS)
+    if rng.random() < 0.8: lap[rng.choice(['connectIQMeasurements', 'connectIQMeasurement'])] = random_ciq(rng)
+    return lap
+
+
+def fixture_payloads():
+    activities, laps = [], []
+    for name in fixtures.ACTIVITY_FIXTURES:
+        fixture = fixtures.load(name)
+        activities.append((name, fixture['activity']))
+        splits = fixture.get('splits') or {}
+        for i, lap in enumerate((splits.get('lapDTOs') or []) + (fixture['activity'].get('splitSummaries') or [])):
+            laps.append((f"{name} lap {i}", lap))
+    return activities, laps
+
+
+def compare(cases, legacy, current, mismatches):
+    for label, payload in cases:
+        old, new = outcome(legacy, payload), outcome(current, payload)
+        if old != new: mismatches.append((label, payload, old, new))
+    return len(cases)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Check that the compiled extractor matches the per-field code it replaced.")
+    parser.add_argument('--payloads', type=int, default=3000, help="randomised activities (and as many laps)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    activities, laps = fixture_payloads()
+    activities += [(f"random activity {i}", random_activity(rng)) for i in range(args.payloads)]
+    laps += [(f"random lap {i}", random_lap(rng)) for i in range(args.payloads)]
+
+    mismatches = []
+    checked = compare(activities, legacy_summary, current_summary, mismatches)
+    checked += compare(laps, legacy_lap, current_lap, mismatches)
+    if mismatches:
+        for label, payload, old, new in mismatches[:5]:
+            print(f"❌ {label}\n   payload: {payload!r}\n   before:  {old}\n   now:     {new}")
+        print(f"{len(mismatches)} of {checked} payloads differ")
+        sys.exit(1)
+    print(f"✅ {checked} payloads ({len(activities)} activities, {len(laps)} laps) give identical output")
+
+
+if __name__ == '__main__':
+    main_cli()
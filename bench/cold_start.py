@@ -0,0 +1,142 @@
+"""
+COLD-START BENCHMARK / BENCHMARK DE ARRANQUE EN FRÍO
+
+Every sample is a brand-new Python process, like a new Cloud Run instance, that
+imports main and serves one Telegram update against the fakes in bench/fakes.py:
+  import   time of `import main`
+  warm-up  time of the instance-start warm-up (warm mode only)
+  first    time of the first request through telegram_webhook
+  total    process spawn to first answer, interpreter start-up included
+plus the heavy modules (garminconnect, requests, numpy) loaded by then.
+
+Modes:
+  eager   LAZY_IMPORTS=0: everything is imported with main
+  lazy    LAZY_IMPORTS=1: heavy modules load with the first command that needs them
+  warm    lazy, and the instance-start warm-up finished before the first request
+
+    python bench/cold_start.py
+    python bench/cold_start.py --runs 10 --command hola --command morning --json cold.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ['eager', 'lazy', 'warm']
+HEAVY_MODULES = ['garminconnect', 'requests', 'numpy']
+CHAT_ID = 4242
+
+
+def child(mode, command, latency):
+    """Runs inside the fresh process: one import, one request, one JSON line on stdout."""
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    tmp = tempfile.mkdtemp(prefix='garmin-cold-')
+    tokenstore = os.path.join(tmp, 'tokens')
+    # A deployed instance already has saved tokens / Una instancia desplegada ya tiene tokens
+    os.makedirs(tokenstore)
+    with open(os.path.join(tokenstore, 'garmin_tokens.json'), 'w') as f: f.write('{}')
+    os.environ.update(BOT_DB=os.path.join(tmp, 'bench.sqlite3'), GARMIN_TOKENSTORE=tokenstore,
+                      TELEGRAM_TOKEN='bench', TRACE_LOGS='0', WARMUP_ON_START='0',
+                      LAZY_IMPORTS='0' if mode == 'eager' else '1')
+    logging.disable(logging.CRITICAL)
+
+    from fakes import FakeGarmin, FakeRequest, FakeTelegramSession
+    garmin = FakeGarmin(latency=latency, jitter=0, login_latency=latency)
+    telegram = FakeTelegramSession(latency=latency)
+
+    started = time.perf_counter()
+    import main
+    import_s = time.perf_counter() - started
+
+    # The real imports still happen (they are what is measured); only the network is faked
+    real_load, real_get_telegram = main.load_garminconnect, main.get_telegram
+
+    def load_garminconnect():
+        real_load()
+        main.Garmin = lambda *a, **k: garmin
+        return main.Garmin
+
+    def get_telegram():
+        client = real_get_telegram()
+        client.session = telegram
+        return client
+
+    main.load_garminconnect, main.get_telegram = load_garminconnect, get_telegram
+
+    warmup_s = None
+    if mode == 'warm':
+        started = time.perf_counter()
+        main.start_instance_warmup().result()
+        warmup_s = time.perf_counter() - started
+
+    request = FakeRequest(body={'update_id': 1, 'message': {'chat': {'id': CHAT_ID}, 'text': command}})
+    started = time.perf_counter()
+    main.telegram_webhook(request)
+    first_s = time.perf_counter() - started
+    print(json.dumps({
+        'import_ms': import_s * 1000, 'warmup_ms': warmup_s * 1000 if warmup_s is not None else None,
+        'first_ms': first_s * 1000, 'done_at': time.time(), 'garmin_calls': sum(garmin.calls.values()),
+        'modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def run_child(mode, command, latency):
+    spawned = time.time()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, command, '--latency', str(latency)],
+                            capture_output=True, text=True)
+    if result.returncode != 0: raise RuntimeError(f"{mode} {command!r} failed:\n{result.stderr}")
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['total_ms'] = (sample.pop('done_at') - spawned) * 1000
+    return sample
+
+
+def median(samples, key):
+    values = [s[key] for s in samples if s[key] is not None]
+    return statistics.median(values) if values else None
+
+
+def bench_cold_start(modes, commands, runs, latency):
+    results = {}
+    for command in commands:
+        for mode in modes:
+            samples = [run_child(mode, command, latency) for _ in range(runs)]
+            results[f"{command}/{mode}"] = {
+                'import_ms': median(samples, 'import_ms'), 'warmup_ms': median(samples, 'warmup_ms'),
+                'first_ms': median(samples, 'first_ms'), 'total_ms': median(samples, 'total_ms'),
+                'garmin_calls': median(samples, 'garmin_calls'), 'modules': samples[-1]['modules'],
+            }
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: import time and time to first response.")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes per command and mode")
+    parser.add_argument('--command', action='append', help="Telegram text to send first (repeatable, default: hola, morning, 0)")
+    parser.add_argument('--mode', action='append', choices=MODES, help="start-up mode (repeatable, default: all)")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake Garmin/Telegram latency per call (s)")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'COMMAND'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child: return child(*args.child, args.latency)
+
+    results = bench_cold_start(args.mode or MODES, args.command or ['hola', 'morning', '0'], args.runs, args.latency)
+    print(f"\n{'COMMAND/MODE':<18} {'import ms':>10} {'warm-up ms':>11} {'first ms':>9} {'total ms':>9} {'garmin':>7}  loaded")
+    for name, s in results.items():
+        warmup = f"{s['warmup_ms']:>11.1f}" if s['warmup_ms'] is not None else f"{'-':>11}"
+        print(f"{name:<18} {s['import_ms']:>10.1f} {warmup} {s['first_ms']:>9.1f} {s['total_ms']:>9.1f} "
+              f"{s['garmin_calls']:>7.0f}  {', '.join(s['modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main_cli()
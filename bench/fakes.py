@@ -0,0 +1,282 @@
+"""
+FAKE GARMIN & TELEGRAM / GARMIN Y TELEGRAM FALSOS
+
+Stand-ins for the benchmark suite, fed from bench/fixtures/:
+  FakeGarmin: answers every garminconnect call main.py uses, with configurable
+    latency (mean + jitter) and failure injection (random rate or whole endpoints,
+    answered with an HTTP status: 503 by default, 429 to exercise the rate limiting).
+  FakeTelegramSession: replaces the requests.Session of main's TelegramClient,
+    records every Bot API call and rejects broken Markdown / MarkdownV2 like Telegram does.
+  FakeRequest: the webhook request (query args and JSON body).
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import fixtures
+
+
+class FakeGarminError(Exception):
+    """Injected failure, carrying an HTTP response like the errors garminconnect raises (503 by default)."""
+
+    def __init__(self, endpoint, status=503):
+        super().__init__(f"{status} Server Error: injected failure on {endpoint}")
+        self.endpoint = endpoint
+        self.response = _FakeResponse(status, None)
+
+
+class _TokenClient:
+    def dump(self, path): pass
+
+
+class FakeGarmin:
+    """
+    One shared fake account with `history` activities, newest first, one per day.
+    Activity ids cycle through the bundled fixtures. Answers are stored as JSON and
+    decoded on every call, so callers pay the same parsing cost as with the real client.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.3, failure_rate=0.0, fail_endpoints=(), login_latency=0.3,
+                 history=200, seed=1, fail_status=503):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.fail_endpoints = set(fail_endpoints)
+        self.fail_status = fail_status
+        self.login_latency = login_latency
+        self.client = _TokenClient()
+        self.display_name = 'bench-athlete'
+        self.calls = Counter()
+        self.failures = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._streams = {}
+
+        self._fixtures = [fixtures.load(name) for name in fixtures.ACTIVITY_FIXTURES]
+        self._fixture_json = [{k: json.dumps(v) for k, v in fx.items()} for fx in self._fixtures]
+        self._morning = {k: json.dumps(v) for k, v in fixtures.load('morning').items()}
+
+        today = date.today()
+        self._activities = []
+        for offset in range(history):
+            entry = dict(self._fixtures[offset % len(self._fixtures)]['list_entry'])
+            day = (today - timedelta(days=offset)).isoformat()
+            entry['activityId'] = 10_000_000 + history - offset
+            entry['startTimeLocal'] = f"{day} {entry['startTimeLocal'][11:]}"
+            self._activities.append(entry)
+
+    # --- Simulated network / Red simulada ---
+
+    def _call(self, endpoint, delay=None):
+        with self._lock:
+            self.calls[endpoint] += 1
+            if delay is None: delay = self.latency * max(0.0, 1 + self._rng.uniform(-self.jitter, self.jitter))
+            fail = endpoint in self.fail_endpoints or self._rng.random() < self.failure_rate
+            if fail: self.failures[endpoint] += 1
+        if delay: time.sleep(delay)
+        if fail: raise FakeGarminError(endpoint, self.fail_status)
+
+    def _fixture_index(self, act_id):
+        return (int(act_id) - 10_000_000) % len(self._fixtures)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.failures.clear()
+
+    # --- garminconnect API ---
+
+    def login(self, tokenstore=None):
+        self._call('login', self.login_latency)
+
+    def get_user_settings(self):
+        self._call('get_user_settings')
+        return json.loads(self._morning['user_settings'])
+
+    def get_sleep_data(self, cdate):
+        self._call('get_sleep_data')
+        return json.loads(self._morning['sleep'])
+
+    def get_body_battery(self, startdate, enddate=None):
+        self._call('get_body_battery')
+        if enddate is None or enddate == startdate: return json.loads(self._morning['body_battery'])
+        return [{'date': day, 'bodyBatteryValuesArray': [[0, rng.randint(10, 30)], [1, rng.randint(60, 100)]]}
+                for day, rng in self._days(startdate, enddate)]
+
+    def get_user_summary(self, cdate):
+        self._call('get_user_summary')
+        return json.loads(self._morning['user_summary'])
+
+    def get_training_readiness(self, cdate):
+        self._call('get_training_readiness')
+        return json.loads(self._morning['readiness'])
+
+    def get_hrv_data(self, cdate):
+        self._call('get_hrv_data')
+        return json.loads(self._morning['hrv'])
+
+    def get_activities(self, start=0, limit=20, activitytype=None):
+        self._call('get_activities')
+        return json.loads(json.dumps(self._activities[start:start + limit]))
+
+    def get_activity(self, activity_id):
+        self._call('get_activity')
+        activity = json.loads(self._fixture_json[self._fixture_index(activity_id)]['activity'])
+        activity['activityId'] = int(activity_id)
+        return activity
+
+    def get_activity_details(self, activity_id, maxchart=2000, maxpoly=4000):
+        self._call('get_activity_details')
+        idx = self._fixture_index(activity_id)
+        key = (idx, maxchart)
+        if key not in self._streams: self._streams[key] = json.dumps(self.build_stream(self._fixtures[idx], maxchart))
+        return json.loads(self._streams[key])
+
+    @staticmethod
+    def _days(start, end):
+        """(day, Random seeded by the day) from start to end, so every day keeps its values."""
+        day, last = date.fromisoformat(start), date.fromisoformat(end)
+        while day <= last:
+            yield day.isoformat(), random.Random(day.toordinal())
+            day += timedelta(days=1)
+
+    def _health_range(self, path, params):
+        """Answers of the daily range endpoints (sleep score, HRV, resting HR), None for other paths."""
+        match = re.search(r'/sleep/score/([\d-]+)/([\d-]+)$', path)
+        if match:
+            self._call('sleep_score_range')
+            return [{'calendarDate': day, 'value': rng.randint(60, 92)} for day, rng in self._days(*match.groups())]
+        match = re.search(r'/hrv/daily/([\d-]+)/([\d-]+)$', path)
+        if match:
+            self._call('hrv_range')
+            return {'hrvSummaries': [{'calendarDate': day, 'weeklyAvg': rng.randint(54, 68), 'status': 'BALANCED'}
+                                     for day, rng in self._days(*match.groups())]}
+        if '/userstats-service/wellness/daily/' in path:
+            self._call('rhr_range')
+            rows = [{'calendarDate': day, 'value': float(rng.randint(43, 50))}
+                    for day, rng in self._days(params['fromDate'], params['untilDate'])]
+            return {'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': rows}}}
+        return None
+
+    def connectapi(self, path, **kwargs):
+        health = self._health_range(path, kwargs.get('params'))
+        if health is not None: return health
+        if path.endswith('/heartRateZones'):
+            self._call('heartRateZones')
+            return [{'sport': 'DEFAULT', 'trainingMethod': 'HR_RESERVE', 'zone1Floor': 98, 'zone2Floor': 118,
+                     'zone3Floor': 137, 'zone4Floor': 156, 'zone5Floor': 175, 'maxHeartRateUsed': 192},
+                    {'sport': 'RUNNING', 'trainingMethod': 'LACTATE_THRESHOLD', 'zone1Floor': 104, 'zone2Floor': 125,
+                     'zone3Floor': 143, 'zone4Floor': 160, 'zone5Floor': 172, 'maxHeartRateUsed': 192}]
+        match = re.search(r'/activity/(\d+)/(\w+)$', path)
+        endpoint = match.group(2) if match else path
+        self._call(endpoint)
+        if not match: return {}
+        fx = self._fixture_json[self._fixture_index(match.group(1))]
+        if endpoint == 'hrTimeInZones': return json.loads(fx['zones'])
+        if endpoint == 'splits': return json.loads(fx['splits'])
+        return {}
+
+    @staticmethod
+    def build_stream(fx, maxchart):
+        """Per-second stream rebuilt from the laps (constant speed/HR per lap plus noise), downsampled to maxchart."""
+        # Imported here so the cold-start benchmark sees numpy load only when main needs it
+        import numpy as np
+
+        laps = (fx['splits'] or {}).get('lapDTOs') or fx['activity'].get('splitSummaries') or []
+        laps = [l for l in laps if l.get('splitType') != 'splitSummaries' and l.get('duration')]
+        if not laps: return {'metricDescriptors': [], 'activityDetailMetrics': []}
+
+        rng = np.random.default_rng(7)
+        speed = np.concatenate([np.full(int(l['duration']), l['distance'] / l['duration']) for l in laps])
+        hr = np.concatenate([np.full(int(l['duration']), float(l.get('averageHR') or 0)) for l in laps])
+        speed = speed * rng.normal(1.0, 0.03, speed.size)
+        hr = hr + rng.normal(0.0, 1.5, hr.size)
+        t = np.arange(speed.size, dtype=float)
+        dist = np.cumsum(speed)
+        step = max(1, int(np.ceil(speed.size / maxchart)))
+        table = np.column_stack([t, dist, speed, hr])[::step].round(2)
+        keys = ['sumDuration', 'sumDistance', 'directSpeed', 'directHeartRate']
+        return {
+            'metricDescriptors': [{'metricsIndex': i, 'key': key} for i, key in enumerate(keys)],
+            'activityDetailMetrics': [{'metrics': row} for row in table.tolist()],
+        }
+
+
+class FakeRequest:
+    """The bits of a Flask request that main.telegram_webhook reads."""
+
+    def __init__(self, args=None, body=None):
+        self.args = args or {}
+        self.body = body
+        self.headers = {}
+        self.path = '/'
+
+    def get_json(self, silent=False):
+        return self.body
+
+
+class _FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.headers = {}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeTelegramSession:
+    """
+    Drop-in for requests.Session in main.TelegramClient.
+    Legacy Markdown with an unbalanced * or _ outside code blocks, or MarkdownV2 with an unescaped
+    reserved character, gets the same 400 "can't parse entities" answer Telegram sends, so the
+    plain-text retry is measured too.
+    """
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.calls = Counter()
+        self.parse_errors = 0
+        self.messages = []
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def mount(self, prefix, adapter): pass
+
+    @staticmethod
+    def _markdown_broken(text):
+        outside_code = "".join(text.split("```")[::2])
+        outside_code = re.sub(r'`[^`]*`', '', outside_code)
+        return outside_code.count('*') % 2 == 1 or outside_code.count('_') % 2 == 1
+
+    @staticmethod
+    def _markdown_v2_broken(text):
+        # Drops escaped characters, code blocks and code spans, scanning left to right
+        outside_code = re.sub(r'\\.|```.*?```|`(?:\\.|[^`\\])*`', '', text, flags=re.S)
+        return (re.search(r'[\[\]()~>#+\-=|{}.!]', outside_code) is not None
+                or outside_code.count('*') % 2 == 1 or outside_code.count('_') % 2 == 1)
+
+    def post(self, url, json=None, timeout=None):
+        method = url.rsplit('/', 1)[1]
+        if self.latency: time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            check = {'Markdown': self._markdown_broken, 'MarkdownV2': self._markdown_v2_broken}.get(json.get('parse_mode'))
+            if check and check(json.get('text', '')):
+                self.parse_errors += 1
+                return _FakeResponse(400, {'ok': False, 'error_code': 400,
+                                           'description': "Bad Request: can't parse entities"})
+            if 'text' in json: self.messages.append(json['text'])
+            if method == 'editMessageText': return _FakeResponse(200, {'ok': True, 'result': {'message_id': json['message_id']}})
+            self._message_id += 1
+            return _FakeResponse(200, {'ok': True, 'result': {'message_id': self._message_id}})
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.parse_errors = 0
+            self.messages.clear()
@@ -0,0 +1,174 @@
+"""
+BENCHMARK FIXTURES / FIXTURES PARA BENCHMARKS
+
+Garmin payloads for the benchmark suite, stored as JSON in bench/fixtures/.
+
+    python bench/fixtures.py synth             # regenerate the bundled fixtures
+    python bench/fixtures.py record 0 my_run   # record activity 0 from Garmin (sanitised)
+
+Every activity fixture is {"list_entry", "activity", "zones", "splits"}: the
+get_activities item, get_activity, hrTimeInZones and splits answers. The
+per-second stream is not stored (it is huge); FakeGarmin rebuilds one from
+the laps. morning.json holds the answers of the morning report endpoints.
+"""
+import json
+import os
+import random
+import sys
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ACTIVITY_FIXTURES = ['short_run', 'intervals_100_laps', 'ultra_splits', 'missing_fields']
+
+EF_APP_ID = "e9f83886-2e1d-448e-aa0a-0cdfb9160df9"
+
+# Personal data removed from recorded payloads / Datos personales que se eliminan
+PRIVATE_KEYS = {
+    'activityName', 'description', 'ownerId', 'ownerDisplayName', 'ownerFullName', 'userProfileId',
+    'ownerProfileImageUrlSmall', 'ownerProfileImageUrlMedium', 'ownerProfileImageUrlLarge',
+    'startLatitude', 'startLongitude', 'endLatitude', 'endLongitude', 'latitude', 'longitude',
+    'deviceId', 'deviceName', 'userPro', 'uuid', 'courseId', 'locationName', 'geoPolylineDTO',
+}
+
+
+def load(name):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding='utf-8') as f: return json.load(f)
+
+
+def save(name, data):
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def sanitize(value):
+    """Drops personal and GPS keys at any depth; names and places become placeholders."""
+    if isinstance(value, dict):
+        clean = {k: sanitize(v) for k, v in value.items() if k not in PRIVATE_KEYS}
+        if 'locationName' in value: clean['locationName'] = "Somewhere"
+        if 'activityName' in value: clean['activityName'] = "Activity"
+        return clean
+    if isinstance(value, list): return [sanitize(v) for v in value]
+    return value
+
+
+def record(index, name):
+    """Downloads activity `index` (0 = latest) with the real session and saves it sanitised."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+
+    entry = main.with_garmin(lambda g: g.get_activities(index, 1))[0]
+    act_id = entry['activityId']
+    data = main.with_garmin(lambda g: {
+        'list_entry': entry,
+        'activity': g.get_activity(act_id),
+        'zones': g.connectapi(f"/activity-service/activity/{act_id}/hrTimeInZones"),
+        'splits': g.connectapi(f"/activity-service/activity/{act_id}/splits"),
+    })
+    save(name, sanitize(data))
+    print(f"Saved {name}.json (activity {act_id})")
+
+
+# --- SYNTHETIC FIXTURES / FIXTURES SINTÉTICOS ---
+# Same shape as the Garmin answers, generated with a fixed seed
+
+def _ciq(field_num, value):
+    return [{'appID': EF_APP_ID, 'developerFieldNumber': field_num, 'value': f"{value:.2f}"}]
+
+
+def _lap(rng, dist, speed, hr, ciq=True, **extra):
+    lap = {
+        'distance': dist, 'duration': round(dist / speed, 1), 'averageSpeed': round(speed, 3),
+        'avgGradeAdjustedSpeed': round(speed * rng.uniform(0.98, 1.04), 3), 'averageHR': hr,
+        'averageRunCadence': rng.randint(164, 186), 'groundContactTime': rng.randint(215, 260),
+    }
+    if ciq: lap['connectIQMeasurement'] = _ciq(1, speed * 60 / hr)
+    lap.update(extra)
+    return lap
+
+
+def _zones(duration, lows=(98, 118, 137, 156, 175)):
+    shares = [0.05, 0.25, 0.4, 0.25, 0.05]
+    return [{'zoneNumber': i + 1, 'secsInZone': round(duration * share), 'zoneLowBoundary': low}
+            for i, (share, low) in enumerate(zip(shares, lows))]
+
+
+def _activity(act_id, type_key, start, laps, **summary):
+    distance = sum(l['distance'] for l in laps)
+    duration = sum(l['duration'] for l in laps)
+    summary_dto = {
+        'startTimeLocal': start, 'distance': distance, 'duration': duration, 'averageSpeed': distance / duration,
+        'averageHR': round(sum(l['averageHR'] * l['duration'] for l in laps) / duration),
+        'maxHR': max(l['averageHR'] for l in laps) + 8, 'trainingEffect': 3.4, 'anaerobicTrainingEffect': 1.2,
+        'activityTrainingLoad': round(duration / 30), 'calories': round(distance / 14), 'averageRunCadence': 174,
+        'maxRunCadence': 196, 'strideLength': 112.4, 'verticalRatio': 7.9, 'verticalOscillation': 8.6,
+        'groundContactTime': 238, 'averagePower': 286, 'elevationGain': 85, 'minElevation': 20.4, 'maxElevation': 71.0,
+        'avgGradeAdjustedSpeed': distance / duration * 1.01, 'directWorkoutRpe': 60, 'directWorkoutFeel': 75,
+        'connectIQMeasurements': _ciq(2, distance / duration * 60 / 150),
+    }
+    summary_dto.update(summary)
+    activity = {'activityId': act_id, 'locationName': "Somewhere", 'activityTypeDTO': {'typeKey': type_key},
+                'summaryDTO': summary_dto, 'splitSummaries': []}
+    list_entry = {'activityId': act_id, 'activityName': "Activity", 'startTimeLocal': start.replace('T', ' '),
+                  'activityType': {'typeKey': type_key}, 'distance': distance, 'duration': duration,
+                  'activityTrainingLoad': summary_dto.get('activityTrainingLoad')}
+    return activity, list_entry
+
+
+def synth():
+    rng = random.Random(42)
+
+    # Easy 5 km with automatic 1 km laps / Rodaje de 5 km con vueltas automáticas
+    laps = [_lap(rng, 1000.0, rng.uniform(3.2, 3.4), rng.randint(142, 152)) for _ in range(5)]
+    activity, entry = _activity(9000000001, 'running', '2026-10-16T07:02:11', laps)
+    save('short_run', {'list_entry': entry, 'activity': activity, 'zones': _zones(activity['summaryDTO']['duration']),
+                       'splits': {'lapDTOs': laps}})
+
+    # Track session: warm-up, 49 x (400 m fast + 200 m float), cool-down = 100 laps
+    laps = [_lap(rng, 2000.0, 3.1, 138)]
+    for _ in range(49):
+        laps.append(_lap(rng, 400.0, rng.uniform(5.2, 5.6), rng.randint(168, 182)))
+        laps.append(_lap(rng, 200.0, rng.uniform(2.6, 3.0), rng.randint(150, 160)))
+    laps.append(_lap(rng, 1800.0, 3.0, 140))
+    activity, entry = _activity(9000000002, 'track_running', '2026-10-14T18:30:00', laps)
+    save('intervals_100_laps', {'list_entry': entry, 'activity': activity,
+                                'zones': _zones(activity['summaryDTO']['duration']), 'splits': {'lapDTOs': laps}})
+
+    # Mountain ultra: no laps, long splitSummaries including the whole-activity entry
+    splits = [_lap(rng, rng.uniform(1800.0, 2600.0), rng.uniform(1.6, 2.6), rng.randint(128, 150), ciq=False,
+                   splitType=rng.choice(['RWD_RUN', 'RWD_WALK', 'RWD_STAND']), elevationGain=rng.randint(0, 180))
+              for _ in range(60)]
+    activity, entry = _activity(9000000003, 'trail_running', '2026-10-11T05:00:00', splits,
+                                elevationGain=4120, minElevation=812.0, maxElevation=2466.0)
+    summary = activity['summaryDTO']
+    whole = _lap(rng, summary['distance'], summary['averageSpeed'], summary['averageHR'], ciq=False,
+                 splitType='splitSummaries')
+    whole['duration'] = summary['duration']
+    activity['splitSummaries'] = [whole] + splits
+    save('ultra_splits', {'list_entry': entry, 'activity': activity, 'zones': _zones(summary['duration']),
+                          'splits': {'lapDTOs': []}})
+
+    # Gym session: almost every field missing, no zones, no splits
+    activity = {'activityId': 9000000004, 'activityTypeDTO': {'typeKey': 'strength_training'},
+                'summaryDTO': {'startTimeLocal': '2026-10-15T19:45:00', 'duration': 2710.0, 'calories': 301,
+                               'averageHR': None, 'directWorkoutFeel': None}}
+    entry = {'activityId': 9000000004, 'activityName': "Activity", 'startTimeLocal': '2026-10-15 19:45:00',
+             'activityType': {'typeKey': 'strength_training'}, 'duration': 2710.0}
+    save('missing_fields', {'list_entry': entry, 'activity': activity, 'zones': [], 'splits': {}})
+
+    save('morning', {
+        'user_settings': {'userData': {'timeZone': 'Europe/Madrid', 'measurementSystem': 'metric'}},
+        'sleep': {'dailySleepDTO': {'sleepTimeSeconds': 26820,
+                                    'sleepScores': {'overall': {'value': 82, 'qualifierKey': 'GOOD'}}}},
+        'body_battery': [{'bodyBatteryValuesArray': [[1760650000000 + i * 180000, v] for i, v in
+                                                     enumerate([22, 25, 31, 40, 52, 63, 71, 78, 84, 86, 85, 83])]}],
+        'user_summary': {'restingHeartRate': 46, 'trainingReadinessDynamicDTO': {'score': 74}},
+        'readiness': [{'score': 74, 'level': 'MODERATE'}],
+        'hrv': {'hrvSummary': {'status': 'BALANCED', 'weeklyAvg': 61, 'lastNightAvg': 64}},
+    })
+    print(f"Fixtures written to {FIXTURES_DIR}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'synth': synth()
+    elif len(sys.argv) == 4 and sys.argv[1] == 'record': record(int(sys.argv[2]), sys.argv[3])
+    else: print(__doc__)
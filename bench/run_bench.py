@@ -0,0 +1,218 @@
+"""
+BENCHMARK SUITE / SUITE DE BENCHMARKS
+
+Measures the bot offline, against the fixtures in bench/fixtures/ and the fakes in bench/fakes.py:
+  1. Throughput of the hot functions (process_report, render_activity in every format,
+     analyze_stream, build_morning_report) for every fixture.
+  2. End-to-end latency (p50/p99) of every command through telegram_webhook, both with
+     empty caches ("cold") and after a first answer ("warm"), plus the Garmin and
+     Telegram calls each command makes.
+
+    python bench/run_bench.py
+    python bench/run_bench.py --latency 0.15 --failure-rate 0.05 --json today.json
+    python bench/run_bench.py --baseline today.json      # exit code 1 on a regression
+
+Nothing here touches the network; tokens and the SQLite store live in a temp dir.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# main reads its configuration at import time / main lee la configuración al importarse
+_tmp = tempfile.mkdtemp(prefix='garmin-bench-')
+os.environ['BOT_DB'] = os.path.join(_tmp, 'bench.sqlite3')
+os.environ['GARMIN_TOKENSTORE'] = os.path.join(_tmp, 'tokens')
+os.environ.setdefault('TELEGRAM_TOKEN', 'bench')
+# Span JSON lines would be mixed into the tables (TRACE_LOGS=1 to measure them too)
+os.environ.setdefault('TRACE_LOGS', '0')
+# Back-to-back runs would mostly measure the Garmin rate limit (GARMIN_RATE=5 to include it)
+os.environ.setdefault('GARMIN_RATE', '0')
+
+import fixtures  # noqa: E402
+import main  # noqa: E402
+from fakes import FakeGarmin, FakeRequest, FakeTelegramSession  # noqa: E402
+from stream_analysis import analyze_stream  # noqa: E402
+
+CHAT_ID = 4242
+
+# (name, path, command)
+COMMANDS = [
+    ('morning', 'telegram', 'morning'),
+    ('menu', 'telegram', 'menu'),
+    ('activity', 'telegram', '0'),
+    ('activities_0-2', 'telegram', '0-2'),
+    ('intervals', 'telegram', '1'),
+    ('load', 'telegram', 'week'),
+    ('trend', 'telegram', 'tendencia'),
+    ('profile', 'telegram', 'perfil'),
+    ('help', 'telegram', 'hola'),
+    ('siri_morning', 'siri', 'morning'),
+    ('siri_activity', 'siri', '0'),
+]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def throughput(func, min_time=0.3):
+    """Calls per second, timed in batches until min_time has passed."""
+    calls, batch, start = 0, 1, time.perf_counter()
+    while True:
+        for _ in range(batch): func()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time: return calls / elapsed
+        batch *= 2
+
+
+def reset_state():
+    """Empties every cache so the next command pays the full Garmin round trips."""
+    main.invalidate_activity()
+    with main._db_lock:
+        db = main.get_db()
+        db.execute("DELETE FROM morning_reports")
+        db.execute("DELETE FROM history")
+        db.execute("DELETE FROM daily_health")
+        db.execute("DELETE FROM profiles")
+        db.commit()
+    with main._render_lock: main._render_cache.clear()
+    main._activity_index.clear()
+    main._profiles.clear()
+
+
+def bench_functions(min_time):
+    results = {}
+    garmin = FakeGarmin(latency=0, login_latency=0)
+    for name in fixtures.ACTIVITY_FIXTURES:
+        fx = fixtures.load(name)
+        details = FakeGarmin.build_stream(fx, main.STREAM_MAX_SAMPLES)
+        stream = analyze_stream(details)
+        metrics = main.process_report(fx['activity'], fx['zones'], fx['splits'], stream)
+        results[f"process_report[{name}]"] = throughput(
+            lambda: main.process_report(fx['activity'], fx['zones'], fx['splits'], stream), min_time)
+        for fmt in ['markdownv2', 'html', 'plain', 'json']:
+            results[f"render_activity[{name}/{fmt}]"] = throughput(lambda: main.render_activity(metrics, fmt), min_time)
+        if details['activityDetailMetrics']:
+            results[f"analyze_stream[{name}]"] = throughput(lambda: analyze_stream(details), min_time)
+    results["build_morning_report"] = throughput(lambda: main.build_morning_report(garmin, "2026-10-17"), min_time)
+    return results
+
+
+def run_command(path, command, update_id):
+    if path == 'siri': request = FakeRequest(args={'siri': '1', 'command': command})
+    else: request = FakeRequest(body={'update_id': update_id, 'message': {'chat': {'id': CHAT_ID}, 'text': command}})
+    start = time.perf_counter()
+    main.telegram_webhook(request)
+    return time.perf_counter() - start
+
+
+def bench_commands(garmin, telegram, iterations):
+    results = {}
+    update_id = 0
+    for name, path, command in COMMANDS:
+        for mode in ['cold', 'warm']:
+            latencies = []
+            garmin.reset_counters()
+            telegram.reset_counters()
+            if mode == 'warm':
+                reset_state()
+                update_id += 1
+                run_command(path, command, update_id)
+                garmin.reset_counters()
+                telegram.reset_counters()
+            for _ in range(iterations):
+                if mode == 'cold': reset_state()
+                update_id += 1
+                latencies.append(run_command(path, command, update_id))
+            results[f"{name}/{mode}"] = {
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'garmin_calls': sum(garmin.calls.values()) / iterations,
+                'garmin_failures': sum(garmin.failures.values()) / iterations,
+                'telegram_calls': sum(telegram.calls.values()) / iterations,
+                'markdown_retries': telegram.parse_errors / iterations,
+            }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Lists every metric that got worse than the baseline by more than `threshold` (0.2 = 20%)."""
+    regressions = []
+    for name, ops in results['functions'].items():
+        old = baseline.get('functions', {}).get(name)
+        if old and ops < old / (1 + threshold):
+            regressions.append(f"{name}: {old:,.0f} -> {ops:,.0f} ops/s")
+    for name, stats in results['commands'].items():
+        old = baseline.get('commands', {}).get(name)
+        if not old: continue
+        for key in ['p50_ms', 'p99_ms']:
+            if stats[key] > old[key] * (1 + threshold) and stats[key] - old[key] > 1.0:
+                regressions.append(f"{name} {key}: {old[key]:.1f} -> {stats[key]:.1f} ms")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Garmin bot.")
+    parser.add_argument('--iterations', type=int, default=20, help="requests per command and mode")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean Garmin latency per call (s)")
+    parser.add_argument('--jitter', type=float, default=0.3, help="latency jitter (fraction of the mean)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="share of Garmin calls that fail")
+    parser.add_argument('--fail', action='append', default=[], help="Garmin endpoint that always fails (repeatable)")
+    parser.add_argument('--fail-status', type=int, default=503, help="HTTP status of the injected failures (429, 5xx...)")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="latency per Bot API call (s)")
+    parser.add_argument('--min-time', type=float, default=0.3, help="seconds per throughput measurement")
+    parser.add_argument('--only', choices=['functions', 'commands'], help="run a single part")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    parser.add_argument('--verbose', action='store_true', help="keep the bot's own log output")
+    args = parser.parse_args()
+
+    # Injected failures would flood the table with warnings / Las fallas inyectadas llenarían la tabla
+    if not args.verbose: logging.disable(logging.CRITICAL)
+
+    garmin = FakeGarmin(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                        fail_endpoints=args.fail, fail_status=args.fail_status)
+    telegram = FakeTelegramSession(latency=args.telegram_latency)
+    main.Garmin = lambda *a, **k: garmin
+    main.get_telegram().session = telegram
+    main.ASYNC_UPDATES = False
+
+    results = {'functions': {}, 'commands': {}}
+    if args.only != 'commands':
+        results['functions'] = bench_functions(args.min_time)
+        print(f"\n{'FUNCTION':<44} {'ops/s':>12} {'µs/op':>10}")
+        for name, ops in results['functions'].items():
+            print(f"{name:<44} {ops:>12,.0f} {1e6 / ops:>10.1f}")
+
+    if args.only != 'functions':
+        results['commands'] = bench_commands(garmin, telegram, args.iterations)
+        print(f"\n{'COMMAND':<24} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'garmin':>7} {'fails':>6} {'tg':>5} {'md-retry':>8}")
+        for name, s in results['commands'].items():
+            print(f"{name:<24} {s['p50_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['mean_ms']:>9.1f} {s['garmin_calls']:>7.1f} "
+                  f"{s['garmin_failures']:>6.1f} {s['telegram_calls']:>5.1f} {s['markdown_retries']:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print("\n" + ("\n".join(f"❌ {r}" for r in regressions) if regressions else "✅ No regressions"))
+        if regressions: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,183 @@
+"""
+BULK HISTORY EXPORT / EXPORTACIÓN MASIVA DEL HISTORIAL
+
+Exports every past activity as the same metrics dict that process_report()
+builds for the Telegram report, one activity per line (NDJSON) or per row (CSV).
+
+    python export_history.py --out runs.ndjson
+    python export_history.py --format csv --out runs.csv --concurrency 4
+
+Activities are processed one get_activities page at a time and written as soon
+as the page is done, so memory stays flat however long the history is. After
+every page a checkpoint (<out>.checkpoint) is saved with the output size at that
+point; running the same command again truncates rows written after it and resumes
+after the last exported activity instead of starting over. Activities that failed
+are kept in the checkpoint and retried first on the next run. Activities added
+since the first run (newer than the checkpoint's head) are exported before the
+backfill goes on, so the same command also keeps the file up to date; --max only
+limits the backfill.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path): return None
+    with open(path, encoding='utf-8') as f: return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    # Atomic replace so an interrupted run never leaves a broken checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def position(act):
+    """Sort key of an activity in the newest-first list."""
+    return (act.get('startTimeGMT') or '', act['activityId'])
+
+
+def is_exported(act, checkpoint, head=None):
+    """
+    The list is newest first: anything between the head (newest exported activity) and the
+    checkpoint position is already exported. Checkpoints without a head treat everything newer as exported.
+    """
+    if not checkpoint or position(act) < (checkpoint['last_start'], checkpoint['last_activity_id']): return False
+    return head is None or position(act) <= tuple(head)
+
+
+def export_activity(garmin, act, profile=None):
+    """Metrics row for one activity (None when Garmin has no details for it, the exception when it failed)."""
+    act_id = act['activityId']
+    try:
+        payload = main.with_garmin(main.fetch_activity_by_id, act_id, False)
+        if not payload.details: return None
+        metrics = main.process_report(payload.details, payload.zones, payload.splits, payload.stream, profile)
+        return {'activity_id': act_id, **metrics}
+    except Exception as e:
+        logging.error(f"⚠️ Activity {act_id} failed, it will be retried: {e}")
+        return e
+
+
+class RowWriter:
+    """Appends rows as NDJSON lines or CSV rows (nested lists are JSON-encoded in their cell)."""
+
+    def __init__(self, f, fmt, write_header):
+        self.f = f
+        self.fmt = fmt
+        self.write_header = write_header
+        self.csv_writer = None
+
+    def write(self, row):
+        if self.fmt == 'ndjson':
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return
+        flat = {k: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v for k, v in row.items()}
+        if self.csv_writer is None:
+            self.csv_writer = csv.DictWriter(self.f, fieldnames=list(flat.keys()), extrasaction='ignore')
+            if self.write_header: self.csv_writer.writeheader()
+        self.csv_writer.writerow(flat)
+
+
+def export_history(out_path, fmt='ndjson', concurrency=4, page_size=50, max_activities=None):
+    checkpoint_path = f"{out_path}.checkpoint"
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint: logging.info(f"⏯️ Resuming after activity {checkpoint['last_activity_id']} ({checkpoint['done']} done)")
+
+    garmin = main.get_garmin()
+    profile = main.with_garmin(main.get_profile)
+    done = checkpoint['done'] if checkpoint else 0
+    offset = checkpoint['offset'] if checkpoint else 0
+    retry = checkpoint.get('failed', []) if checkpoint else []
+    head = checkpoint.get('head') if checkpoint else None
+    failed = []
+    # Offsets move when activities are added or deleted: rewind one page and skip what is already exported
+    offset = max(0, offset - page_size)
+
+    mode = 'a' if checkpoint else 'w'
+    with open(out_path, mode, encoding='utf-8', newline='') as f, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='export') as pool:
+        # Rows written after the last checkpoint belong to an unfinished page: drop them, the page is redone
+        if checkpoint and 'size' in checkpoint:
+            f.truncate(checkpoint['size'])
+            # tell() keeps the old end of file until the next write / tell() no se entera hasta escribir
+            f.seek(0, os.SEEK_END)
+        writer = RowWriter(f, fmt, write_header=not checkpoint)
+
+        def export_batch(acts):
+            nonlocal done
+            # pool.map keeps list order; at most `concurrency` activities are in flight
+            for act, row in zip(acts, pool.map(lambda act: export_activity(garmin, act, profile), acts)):
+                if isinstance(row, Exception):
+                    failed.append(act['activityId'])
+                    continue
+                if row is not None: writer.write(row)
+                done += 1
+
+        def save():
+            f.flush()
+            save_checkpoint(checkpoint_path, dict(checkpoint, offset=offset, done=done, failed=failed, head=head, size=f.tell()))
+
+        if retry:
+            logging.info(f"🔁 Retrying {len(retry)} failed activities")
+            export_batch([{'activityId': act_id} for act_id in retry])
+            save()
+
+        if head:
+            # Activities added since the last run sit above the head / Las nuevas quedan encima del head
+            new, start = [], 0
+            while True:
+                page = main.with_garmin(lambda g: g.get_activities(start, page_size))
+                newer = [act for act in page if position(act) > tuple(head)]
+                new += newer
+                start += len(page)
+                if len(newer) < len(page) or len(page) < page_size: break
+            if new:
+                logging.info(f"🆕 {len(new)} new activities since the last run")
+                export_batch(new)
+                head = position(new[0])
+                # They also moved the backfill position down the list / También desplazan el backfill
+                offset += len(new)
+                save()
+
+        while max_activities is None or done < max_activities:
+            page = main.with_garmin(lambda g: g.get_activities(offset, page_size))
+            if not page: break
+            if head is None and offset == 0: head = position(page[0])
+            todo = [act for act in page if not is_exported(act, checkpoint, head)]
+            pending = len(todo)
+            if max_activities is not None: todo = todo[:max_activities - done]
+
+            export_batch(todo)
+            if todo: checkpoint = {'last_activity_id': todo[-1]['activityId'], 'last_start': todo[-1].get('startTimeGMT') or ''}
+            offset += len(page)
+            if checkpoint: save()
+            logging.info(f"📦 {done} activities exported, {len(failed)} failed (offset {offset})")
+            # A page cut by --max ends the run; the rest of it is picked up on resume
+            if len(page) < page_size or len(todo) < pending: break
+    return done
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Export every Garmin activity as report metrics (NDJSON/CSV).")
+    parser.add_argument('--out', required=True, help="output file")
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--concurrency', type=int, default=4, help="activities fetched at the same time")
+    parser.add_argument('--page-size', type=int, default=50, help="activities per get_activities page")
+    parser.add_argument('--max', type=int, default=None, help="stop after this many activities")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    total = export_history(args.out, args.format, args.concurrency, args.page_size, args.max)
+    logging.info(f"✅ Done: {total} activities in {args.out}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,12 +1,35 @@
 import os
 import json
+import bisect
+import contextvars
+import hashlib
 import logging
-import requests
+import queue
+import random
+import re
+import secrets
+import shutil
+import sqlite3
+import sys
+import threading
+import time
 import traceback
+import types
+from collections import OrderedDict, deque, namedtuple
+from operator import itemgetter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
 from datetime import date, datetime, timedelta, timezone
 # Importamos ZoneInfo para manejar zonas horarias (Tokio, Madrid, etc.)
 from zoneinfo import ZoneInfo 
-from garminconnect import Garmin
+
+_import_started = time.perf_counter()
+
+# garminconnect, requests and numpy (stream_analysis) load on first use, see load_garminconnect()
+# Se importan al primer uso: el webhook responde ayuda y duplicados sin pagarlos
+Garmin = None
+
+class GarminConnectAuthenticationError(Exception):
+    """Stand-in until garminconnect is imported (nothing can raise the real one before that)."""
 
 # ==============================================================================
 # CONFIGURATION & SETUP / CONFIGURACIÓN Y SET UP
@@ -20,6 +43,90 @@ GARMIN_EMAIL = os.environ.get('GARMIN_EMAIL')
 GARMIN_PASSWORD = os.environ.get('GARMIN_PASSWORD')
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 
+# Garmin OAuth tokens are persisted here so new instances resume the session
+# Los tokens de Garmin se guardan aquí para reanudar la sesión sin login completo
+GARMIN_TOKENSTORE = os.environ.get('GARMIN_TOKENSTORE', os.path.join(os.environ['HOME'], '.garminconnect'))
+
+# Concurrent Garmin fetches (seconds) / Descargas concurrentes de Garmin (segundos)
+GARMIN_WORKERS = int(os.environ.get('GARMIN_WORKERS', '6'))
+MORNING_SECTION_TIMEOUT = float(os.environ.get('MORNING_SECTION_TIMEOUT', '8'))
+MORNING_DEADLINE = float(os.environ.get('MORNING_DEADLINE', '10'))
+ACTIVITY_CALL_TIMEOUT = float(os.environ.get('ACTIVITY_CALL_TIMEOUT', '10'))
+# Per-second samples requested from activity details (~3h of running)
+STREAM_MAX_SAMPLES = int(os.environ.get('STREAM_MAX_SAMPLES', '12000'))
+# Max activities in one "0-2" / "0,3" request
+MULTI_ACTIVITY_MAX = int(os.environ.get('MULTI_ACTIVITY_MAX', '5'))
+# Max distance between the lowest and highest offset ("0,40" lists 41 activities from Garmin)
+MULTI_ACTIVITY_SPAN = int(os.environ.get('MULTI_ACTIVITY_SPAN', '50'))
+
+# Local store for finished activities / Almacén local de actividades terminadas
+BOT_DB = os.environ.get('BOT_DB', os.path.join(os.environ['HOME'], 'garmin_bot.sqlite3'))
+ACTIVITY_STORE_MAX = int(os.environ.get('ACTIVITY_STORE_MAX', '300'))
+ACTIVITY_INDEX_TTL = float(os.environ.get('ACTIVITY_INDEX_TTL', '60'))
+
+# Rendered reports / Reportes ya generados (LRU + TTL en segundos)
+RENDER_CACHE_MAX = int(os.environ.get('RENDER_CACHE_MAX', '128'))
+RENDER_CACHE_TTL = float(os.environ.get('RENDER_CACHE_TTL', '3600'))
+# Format of the Telegram reports: markdownv2 or html / Formato de los reportes en Telegram
+TELEGRAM_FORMAT = os.environ.get('TELEGRAM_FORMAT', 'markdownv2').lower()
+
+# Stored morning report older than this (seconds) is refreshed in the background
+# Reporte matutino guardado con más antigüedad que esto se refresca en segundo plano
+MORNING_STALE_SECS = float(os.environ.get('MORNING_STALE_SECS', '1800'))
+# Shared secret the scheduler sends (X-Warmup-Token header) to run the morning warm-up; unset = disabled
+# Secreto que envía el programador para lanzar el precalentado; sin definir = desactivado
+WARMUP_TOKEN = os.environ.get('WARMUP_TOKEN')
+# Accounts warmed up at the same time / Cuentas que se precalientan a la vez
+WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', '4'))
+
+# Garmin profile snapshot (timezone, units, HR zones) is downloaded again after this many seconds
+# Perfil de Garmin guardado: se vuelve a descargar pasado este tiempo (segundos)
+PROFILE_TTL = float(os.environ.get('PROFILE_TTL', '21600'))
+
+# Training history aggregate / Agregado del historial de entrenamiento
+HISTORY_DAYS = int(os.environ.get('HISTORY_DAYS', '120'))
+HISTORY_PAGE = int(os.environ.get('HISTORY_PAGE', '50'))
+HISTORY_PARALLEL_PAGES = int(os.environ.get('HISTORY_PARALLEL_PAGES', '3'))
+
+# Background processing of Telegram updates (needs "CPU always allocated" on Cloud Run)
+# Procesamiento en segundo plano de updates de Telegram
+ASYNC_UPDATES = os.environ.get('ASYNC_UPDATES', '0') == '1'
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', '2'))
+SEEN_UPDATES_MAX = 1000
+
+# Telegram limits / Límites de Telegram: (connect, read) timeouts in seconds
+TELEGRAM_MAX_LEN = 4096
+TELEGRAM_TIMEOUT = (3.05, 15)
+
+# Multi-user mode: every chat links its own Garmin account with `login <email> <password>`
+# Modo multiusuario: cada chat vincula su propia cuenta de Garmin
+MULTI_USER = os.environ.get('MULTI_USER', '0') == '1'
+# Logged-in Garmin sessions kept in memory (least recently used are dropped)
+GARMIN_POOL_MAX = int(os.environ.get('GARMIN_POOL_MAX', '20'))
+# Commands served at the same time for one user, and how long (s) an extra one waits for a slot
+USER_CONCURRENCY = int(os.environ.get('USER_CONCURRENCY', '2'))
+USER_WAIT = float(os.environ.get('USER_WAIT', '30'))
+
+# Garmin gateway: calls per second (0 = no limit) and burst, shared by every Garmin call of the
+# instance, plus retries with jittered backoff (base seconds) on 429/5xx
+# Pasarela de Garmin: llamadas por segundo, ráfaga y reintentos ante 429/5xx
+GARMIN_RATE = float(os.environ.get('GARMIN_RATE', '5'))
+GARMIN_BURST = int(os.environ.get('GARMIN_BURST', '20'))
+GARMIN_RETRIES = int(os.environ.get('GARMIN_RETRIES', '3'))
+GARMIN_BACKOFF = float(os.environ.get('GARMIN_BACKOFF', '0.5'))
+GARMIN_BACKOFF_MAX = 8.0
+
+# Tracing: one JSON line per span on stdout (Cloud Logging parses it); metrics are always kept
+# Trazas: una línea JSON por span; las métricas se guardan siempre
+TRACE_LOGS = os.environ.get('TRACE_LOGS', '1') == '1'
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Cold start: heavy modules are imported on the first command that needs them (0 = all at import)
+# Arranque en frío: los módulos pesados se importan con el primer comando que los usa
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', '1') == '1'
+# Instance-start warm-up in the background: imports, saved Garmin tokens, Telegram connection, SQLite
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '0') == '1'
+
 # Language Selection / Selección de Idioma (Default: 'es')
 LANG_CODE = os.environ.get('BOT_LANGUAGE', 'es').lower()
 
@@ -35,17 +142,53 @@ EF_FIELD_NUM_LAP = 1
 # ==============================================================================
 # TRANSLATION DICTIONARY / DICCIONARIO DE TRADUCCIÓN
 # ==============================================================================
-TRANS = {
-    'es': {
+# Only the languages in use are built / Solo se construyen los idiomas en uso
+def _strings_es():
+    return {
         'loading_1': "⏳ 1/3 Conectando...",
         'loading_2': "✅ 2/3 Descargando...",
         'loading_vital': "⏳ Obteniendo signos vitales...",
         'loading_hist': "⏳ Consultando historial...",
+        'loading_load': "⏳ Calculando volumen y carga...",
+        'load_title': "📈 **Volumen y Carga**",
+        'sec_weeks': "🗓️ **Semanas**",
+        'sec_months': "📆 **Meses**",
+        'acwr': "⚖️ **ACWR (7d / 28d)**",
+        'acwr_low': "🔵 Carga baja, estás perdiendo forma.",
+        'acwr_ok': "✅ Zona óptima.",
+        'acwr_high': "⚠️ La carga sube rápido.",
+        'acwr_danger': "🛑 Riesgo de lesión, baja la carga.",
+        'loading_trend': "⏳ Calculando tendencias...",
+        'trend_title': "📊 **Tendencias 7/28 días**",
+        'trend_sleep': "💤 Sueño (puntuación)",
+        'trend_rhr': "❤️ FC en reposo",
+        'trend_hrv': "💓 VFC (prom. semanal)",
+        'trend_bb': "🔋 Body Battery (máx.)",
+        'trend_ok': "✅ Estable, sin señales de sobrecarga.",
+        'trend_watch': "👀 Una señal a la baja, vigila la recuperación.",
+        'trend_over': "⚠️ Varias señales de sobrecarga, prioriza el descanso.",
+        'loading_profile': "⏳ Actualizando perfil...",
+        'profile_title': "👤 **Perfil de Garmin**",
+        'lbl_timezone': "🌍 Zona horaria",
+        'lbl_units': "📏 Unidades",
+        'lbl_hr_zones': "❤️ Zonas FC",
         'err_not_found': "❌ No encontré esa actividad.",
         'err_empty': "❌ Error: Actividad vacía.",
         'err_menu': "❌ Error obteniendo menú",
         'err_morning': "❌ Error obteniendo reporte matutino",
-        'help_msg': "🤖 **Comandos:**\n☀️ `mañana` (Salud)\n📋 `lista` (Historial)\n🔢 `0` (Último entreno)",
+        'err_history': "❌ Error calculando la carga",
+        'err_trend': "❌ Error calculando tendencias",
+        'err_profile': "❌ Perfil no disponible",
+        'help_msg': "🤖 **Comandos:**\n☀️ `mañana` (Salud)\n📋 `lista` (Historial)\n📈 `semana` (Volumen y carga)\n📊 `tendencia` (Salud 7/28 días)\n👤 `perfil` (Zona horaria y zonas FC)\n🔢 `0` (Último entreno)\n🔢 `0-2` / `0,3` (Varios entrenos)\n🔄 `actualizar 0` (Recargar tras editar RPE/sensación)\n🌐 `idioma en` | 🕒 `zona -6` (Ajustes)",
+        'err_no_account': "🔐 Este chat no tiene cuenta de Garmin. Envía `login <email> <contraseña>` para vincularla.",
+        'err_session': "🔐 La sesión de Garmin caducó. Envía `login <email> <contraseña>` otra vez.",
+        'login_ok': "✅ Cuenta de Garmin vinculada. Borré tu mensaje con la contraseña (no se guarda).",
+        'login_fail': "❌ No pude iniciar sesión en Garmin",
+        'login_mfa': "❌ Tu cuenta usa verificación en dos pasos (MFA), todavía no está soportada.",
+        'logout_ok': "👋 Cuenta desvinculada y sesión borrada.",
+        'settings_ok': "⚙️ Ajustes guardados",
+        'siri_info': "🎤 Añade esto a la URL de tu atajo de Siri:",
+        'busy': "⏳ Aún estoy con tus comandos anteriores, inténtalo en un momento.",
         'menu_title': "📋 **Últimas Actividades:**",
         'menu_footer': "👉 *Envía el número (0, 1...) para ver detalles.*",
         'morning_title': "🌅 **Reporte Matutino**",
@@ -82,18 +225,59 @@ TRANS = {
         'lbl_gct': "GCT",
         'lbl_osc': "Osc.V",
         'lbl_sens': "Sensación",
+        'sec_stream': "🔬 **ANÁLISIS POR SEGUNDO**",
+        'lbl_drift': "Deriva FC",
+        'lbl_best': "Mejor",
+        'lbl_km_splits': "*Splits por km:*",
         'feel_map': {0: "Muy Débil", 25: "Débil", 50: "Normal", 75: "Fuerte", 100: "Muy Fuerte"}
-    },
-    'en': {
+    }
+
+def _strings_en():
+    return {
         'loading_1': "⏳ 1/3 Connecting...",
         'loading_2': "✅ 2/3 Downloading...",
         'loading_vital': "⏳ Fetching vital signs...",
         'loading_hist': "⏳ Fetching history...",
+        'loading_load': "⏳ Computing volume and load...",
+        'load_title': "📈 **Volume & Load**",
+        'sec_weeks': "🗓️ **Weeks**",
+        'sec_months': "📆 **Months**",
+        'acwr': "⚖️ **ACWR (7d / 28d)**",
+        'acwr_low': "🔵 Low load, you are losing fitness.",
+        'acwr_ok': "✅ Sweet spot.",
+        'acwr_high': "⚠️ Load is ramping up fast.",
+        'acwr_danger': "🛑 Injury risk, back off.",
+        'loading_trend': "⏳ Computing trends...",
+        'trend_title': "📊 **7/28-day Trends**",
+        'trend_sleep': "💤 Sleep score",
+        'trend_rhr': "❤️ Resting HR",
+        'trend_hrv': "💓 HRV (weekly avg)",
+        'trend_bb': "🔋 Body Battery (peak)",
+        'trend_ok': "✅ Stable, no signs of overreaching.",
+        'trend_watch': "👀 One signal trending down, watch your recovery.",
+        'trend_over': "⚠️ Several overreaching signals, prioritise rest.",
+        'loading_profile': "⏳ Refreshing profile...",
+        'profile_title': "👤 **Garmin Profile**",
+        'lbl_timezone': "🌍 Timezone",
+        'lbl_units': "📏 Units",
+        'lbl_hr_zones': "❤️ HR zones",
         'err_not_found': "❌ Activity not found.",
         'err_empty': "❌ Error: Empty activity.",
         'err_menu': "❌ Error fetching menu",
         'err_morning': "❌ Error fetching morning report",
-        'help_msg': "🤖 **Bot Commands:**\n☀️ `morning` (Health)\n📋 `list` (History)\n🔢 `0` (Latest activity)",
+        'err_history': "❌ Error computing training load",
+        'err_trend': "❌ Error computing trends",
+        'err_profile': "❌ Profile not available",
+        'help_msg': "🤖 **Bot Commands:**\n☀️ `morning` (Health)\n📋 `list` (History)\n📈 `week` (Volume & load)\n📊 `trend` (Health 7/28 days)\n👤 `profile` (Timezone and HR zones)\n🔢 `0` (Latest activity)\n🔢 `0-2` / `0,3` (Several activities)\n🔄 `refresh 0` (Reload after editing RPE/feel)\n🌐 `language es` | 🕒 `timezone -6` (Settings)",
+        'err_no_account': "🔐 This chat has no Garmin account. Send `login <email> <password>` to link it.",
+        'err_session': "🔐 Your Garmin session expired. Send `login <email> <password>` again.",
+        'login_ok': "✅ Garmin account linked. I deleted your message with the password (it is not stored).",
+        'login_fail': "❌ Garmin login failed",
+        'login_mfa': "❌ Your account uses two-step verification (MFA), which is not supported yet.",
+        'logout_ok': "👋 Account unlinked and session deleted.",
+        'settings_ok': "⚙️ Settings saved",
+        'siri_info': "🎤 Add this to the URL of your Siri shortcut:",
+        'busy': "⏳ Still working on your previous commands, try again in a moment.",
         'menu_title': "📋 **Recent Activities:**",
         'menu_footer': "👉 *Send the number (0, 1...) for details.*",
         'morning_title': "🌅 **Morning Report**",
@@ -130,11 +314,33 @@ TRANS = {
         'lbl_gct': "GCT",
         'lbl_osc': "V.Osc",
         'lbl_sens': "Feeling",
+        'sec_stream': "🔬 **PER-SECOND ANALYSIS**",
+        'lbl_drift': "HR drift",
+        'lbl_best': "Best",
+        'lbl_km_splits': "*Km splits:*",
         'feel_map': {0: "Very Weak", 25: "Weak", 50: "Normal", 75: "Strong", 100: "Very Strong"}
     }
-}
 
-T = TRANS.get(LANG_CODE, TRANS['es'])
+# Builders by language code / Constructores por código de idioma
+LANGUAGES = {'es': _strings_es, 'en': _strings_en}
+# Built tables, filled on first use / Tablas ya construidas, se llenan al usarse
+TRANS = {}
+
+def strings(lang):
+    """Translation table of lang, built the first time it is needed (unknown codes fall back to 'es')."""
+    table = TRANS.get(lang)
+    if table is None:
+        if lang not in LANGUAGES: lang = 'es'
+        table = TRANS.setdefault(lang, LANGUAGES[lang]())
+    return table
+
+class Translations:
+    """T['key'] in the language of the user being served (see current_user())."""
+
+    def __getitem__(self, key):
+        return strings(current_user().lang)[key]
+
+T = Translations()
 
 # ==============================================================================
 # HELPER FUNCTIONS
@@ -143,15 +349,15 @@ T = TRANS.get(LANG_CODE, TRANS['es'])
 def get_dynamic_today(garmin_client):
     """
     TRAVELER MODE / MODO VIAJERO ✈️
-    Fetches the user's configured timezone from Garmin settings.
-    Obtiene la zona horaria configurada en Garmin para saber qué día es "hoy" para el usuario.
+    Reads the user's configured timezone from the Garmin profile snapshot (see get_profile).
+    Usa la zona horaria del perfil de Garmin guardado para saber qué día es "hoy" para el usuario.
     """
     try:
-        # 1. Fetch User Settings / Obtener Configuración de Usuario
-        settings = garmin_client.get_user_settings()
+        # 1. Profile snapshot, last known one if Garmin is down / Perfil guardado
+        profile = get_profile(garmin_client)
         
-        # 2. Extract Timezone ID (e.g., 'America/Mexico_City', 'Asia/Tokyo')
-        user_tz_name = settings.get('userData', {}).get('timeZone')
+        # 2. Timezone ID (e.g., 'America/Mexico_City', 'Asia/Tokyo')
+        user_tz_name = profile.timezone if profile else None
         
         if user_tz_name:
             # 3. Calculate date in that timezone / Calcular fecha en esa zona
@@ -163,9 +369,9 @@ def get_dynamic_today(garmin_client):
     except Exception as e:
         logging.warning(f"⚠️ Timezone detection failed, using fallback. Error: {e}")
 
-    # 4. Fallback (Manual Offset) / Respaldo Manual
+    # 4. Fallback (Manual Offset) / Respaldo Manual: only if no profile was ever downloaded
     utc_now = datetime.now(timezone.utc)
-    local_now = utc_now + timedelta(hours=FALLBACK_OFFSET)
+    local_now = utc_now + timedelta(hours=current_user().tz_offset)
     return local_now.date().isoformat()
 
 def format_time(seconds):
@@ -196,154 +402,1462 @@ def safe_round(val, decimals=0):
         return round(f, decimals)
     except: return val
 
-def get_ciq_by_id(data, target_app_id, target_field_num):
+def ciq_index(data):
+    """Indexes an object's ConnectIQ measurements once: {(appID, fieldNumber): value} (first valid entry wins)."""
     ciq_list = data.get('connectIQMeasurements') or data.get('connectIQMeasurement', [])
-    if not ciq_list: return None
+    index = {}
+    if not ciq_list: return index
     for item in ciq_list:
-        app_id = str(item.get('appID', ''))
-        field_num = item.get('developerFieldNumber')
-        try:
-            if app_id == target_app_id and int(field_num) == int(target_field_num):
-                return float(item.get('value'))
+        try: key, value = (str(item.get('appID', '')), int(item.get('developerFieldNumber'))), float(item.get('value'))
         except: continue
-    return None
+        index.setdefault(key, value)
+    return index
 
-def send_telegram(chat_id, text, use_markdown=True):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': text}
-    if use_markdown: payload['parse_mode'] = 'Markdown'
-    try:
-        response = requests.post(url, json=payload)
-        response_data = response.json()
+def get_ciq_by_id(data, target_app_id, target_field_num):
+    return ciq_index(data).get((target_app_id, int(target_field_num)))
+
+# ==============================================================================
+# TRACING & METRICS / TRAZAS Y MÉTRICAS
+# ==============================================================================
+
+# Command being served (command, chat_id, trace_id); copied into worker threads by submit_traced()
+_trace_context = contextvars.ContextVar('trace_context', default={})
+
+# (kind, name) -> [bucket counts..., +Inf count, sum]; (kind, name, outcome) -> count
+_span_histograms = {}
+_span_counts = {}
+_metrics_lock = threading.Lock()
+
+class Span:
+    """
+    Times one operation: `with Span('garmin', 'get_activity', activity_id=1): ...`
+    On exit it feeds the /metrics histograms and, with TRACE_LOGS, writes one JSON log line.
+    The outcome is 'ok', the exception name, or whatever the caller set on span.outcome.
+    """
+    __slots__ = ('kind', 'name', 'attrs', 'outcome', 'start')
+
+    def __init__(self, kind, name, **attrs):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.outcome = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        outcome = type(exc).__name__ if exc is not None else (self.outcome or 'ok')
+        record_span(self.kind, self.name, outcome, elapsed, self.attrs)
+        return False
+
+def record_span(kind, name, outcome, elapsed, attrs):
+    key = (kind, name)
+    with _metrics_lock:
+        hist = _span_histograms.get(key)
+        if hist is None: hist = _span_histograms[key] = [0] * (len(SPAN_BUCKETS) + 2)
+        hist[bisect.bisect_left(SPAN_BUCKETS, elapsed)] += 1
+        hist[-1] += elapsed
+        count_key = (kind, name, outcome)
+        _span_counts[count_key] = _span_counts.get(count_key, 0) + 1
+    if not TRACE_LOGS: return
+
+    entry = {'severity': 'INFO' if outcome == 'ok' else 'WARNING',
+             'message': f"{kind} {name} {outcome} {elapsed * 1000:.1f}ms",
+             'span': kind, 'name': name, 'outcome': outcome, 'duration_ms': round(elapsed * 1000, 2)}
+    entry.update(_trace_context.get())
+    entry.update(attrs)
+    # A single write per line keeps concurrent spans from interleaving
+    sys.stdout.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+def command_kind(text):
+    """Low-cardinality label for a command (the raw text only goes to the logs)."""
+    if text in ['mañana', 'morning', 'buenos dias', 'reporte', 'dia', 'report']: return 'morning'
+    if text in ['menu', 'lista', 'historial', 'list', 'history']: return 'menu'
+    if text in HISTORY_COMMANDS: return 'load'
+    if text in TREND_COMMANDS: return 'trend'
+    if text in PROFILE_COMMANDS: return 'profile'
+    try: return 'refresh' if parse_activity_command(text)[1] else 'activity'
+    except ValueError: return 'help'
+
+class trace_command:
+    """Root span of one command; every Garmin/Telegram span inside it carries the same trace_id."""
+
+    def __init__(self, text, source, chat_id=None):
+        self.context = {'trace_id': secrets.token_hex(8), 'command': text, 'source': source}
+        if chat_id is not None: self.context['chat_id'] = chat_id
+        self.span = Span('command', command_kind(text), source=source)
+
+    def __enter__(self):
+        self._token = _trace_context.set(self.context)
+        return self.span.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        try: return self.span.__exit__(exc_type, exc, tb)
+        finally: _trace_context.reset(self._token)
+
+def submit_traced(pool, func, *args):
+    """pool.submit() that keeps the current command's trace context in the worker thread."""
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+_ACTIVITY_PATH = re.compile(r'/activity/(\d+)')
+
+class TracedGarmin:
+    """
+    Wraps the Garmin client so every API method call goes through garmin_request() (rate limit,
+    backoff, single-flight) and becomes a 'garmin' span; a call that shared another caller's
+    answer ends as outcome 'shared'. connectapi() spans are named after the path with ids replaced by ':id'.
+    """
+
+    def __init__(self, garmin, user_key=None):
+        self._garmin = garmin
+        self._user_key = user_key
+
+    def __getattr__(self, name):
+        attr = getattr(self._garmin, name)
+        if not isinstance(attr, types.MethodType): return attr
+
+        def traced(*args, **kwargs):
+            endpoint, attrs = name, {}
+            if name == 'connectapi' and args:
+                endpoint = re.sub(r'\d+', ':id', str(args[0]))
+                match = _ACTIVITY_PATH.search(str(args[0]))
+                if match: attrs['activity_id'] = int(match.group(1))
+            elif name.startswith('get_activity') and args and str(args[0]).isdigit():
+                attrs['activity_id'] = int(args[0])
+            key = (self._user_key, name, repr(args), repr(sorted(kwargs.items())))
+            with Span('garmin', endpoint, **attrs) as span:
+                result, shared = garmin_request(key, attr, *args, **kwargs)
+                if shared: span.outcome = 'shared'
+                return result
+        return traced
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def render_metrics():
+    """Prometheus text exposition of the span metrics, update queue and render cache."""
+    with _metrics_lock:
+        histograms = {key: list(hist) for key, hist in _span_histograms.items()}
+        counts = dict(_span_counts)
+
+    lines = ["# HELP bot_span_seconds Duration of traced operations (garmin, telegram, command, render).",
+             "# TYPE bot_span_seconds histogram"]
+    for (kind, name), hist in sorted(histograms.items()):
+        labels = f'span="{_label(kind)}",name="{_label(name)}"'
+        cumulative = 0
+        for bound, count in zip(SPAN_BUCKETS, hist):
+            cumulative += count
+            lines.append(f'bot_span_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += hist[len(SPAN_BUCKETS)]
+        lines.append(f'bot_span_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f'bot_span_seconds_sum{{{labels}}} {hist[-1]:.6f}')
+        lines.append(f'bot_span_seconds_count{{{labels}}} {cumulative}')
+
+    lines += ["# HELP bot_span_total Traced operations by outcome.", "# TYPE bot_span_total counter"]
+    for (kind, name, outcome), count in sorted(counts.items()):
+        lines.append(f'bot_span_total{{span="{_label(kind)}",name="{_label(name)}",outcome="{_label(outcome)}"}} {count}')
+
+    updates = get_update_stats()
+    lines += ["# TYPE bot_updates_total counter"]
+    for state in ['queued', 'processed', 'failed', 'duplicates']:
+        lines.append(f'bot_updates_total{{state="{state}"}} {updates[state]}')
+    lines += ["# TYPE bot_update_queue_depth gauge", f"bot_update_queue_depth {updates['queue_depth']}",
+              "# TYPE bot_update_parked gauge", f"bot_update_parked {updates['parked']}"]
+
+    cache = get_render_stats()
+    lines += ["# TYPE bot_render_cache_total counter",
+              f'bot_render_cache_total{{result="hit"}} {cache["hits"]}',
+              f'bot_render_cache_total{{result="miss"}} {cache["misses"]}',
+              "# TYPE bot_render_cache_size gauge", f"bot_render_cache_size {cache['size']}"]
+    with _garmin_lock: sessions = len(_garmin_clients)
+    lines += ["# TYPE bot_garmin_sessions gauge", f"bot_garmin_sessions {sessions}",
+              "# TYPE bot_import_seconds gauge", f"bot_import_seconds {IMPORT_SECONDS:.6f}"]
+    gateway = get_gateway_stats()
+    lines += ["# HELP bot_garmin_gateway_total Garmin calls that waited for the rate limit, were retried or shared an in-flight answer.",
+              "# TYPE bot_garmin_gateway_total counter"]
+    for event in ['throttled', 'retries', 'shared']:
+        lines.append(f'bot_garmin_gateway_total{{event="{event}"}} {gateway[event]}')
+    lines += ["# TYPE bot_garmin_throttle_seconds_total counter", f"bot_garmin_throttle_seconds_total {gateway['throttle_seconds']:.6f}",
+              "# TYPE bot_garmin_in_flight gauge", f"bot_garmin_in_flight {gateway['in_flight']}"]
+    return "\n".join(lines) + "\n"
+
+# ==============================================================================
+# TELEGRAM CLIENT / CLIENTE DE TELEGRAM
+# ==============================================================================
+
+def utf16_len(text):
+    # Telegram counts message length in UTF-16 code units (emojis count double)
+    return len(text.encode('utf-16-le')) // 2
+
+def split_message(text, limit=TELEGRAM_MAX_LEN, parse_mode=None):
+    """
+    Splits text into chunks Telegram accepts, cutting on line breaks.
+    A chunk that ends inside a ``` block (<pre> with parse_mode 'HTML') closes it and the next chunk reopens it.
+    """
+    if utf16_len(text) <= limit: return [text]
+
+    html = parse_mode == 'HTML'
+    opener, closer = ("<pre>", "</pre>") if html else ("```", "```")
+    room = limit - len(opener) - len(closer) - 2  # space to close/reopen a code block
+    lines = []
+    for line in text.split("\n"):
+        # Hard-cut lines longer than a whole message / Cortar líneas enormes
+        while utf16_len(line) > room:
+            cut = room
+            while utf16_len(line[:cut]) > room: cut -= 1
+            lines.append(line[:cut])
+            line = line[cut:]
+        lines.append(line)
+
+    chunks, current, size, in_code = [], [], 0, False
+    for line in lines:
+        line_len = utf16_len(line) + 1
+        if current and size + line_len > room:
+            if in_code: current.append(closer)
+            chunks.append("\n".join(current))
+            current, size = ([opener], len(opener) + 1) if in_code else ([], 0)
+        current.append(line)
+        size += line_len
+        if html:
+            # Tags can share a line with the table / Las etiquetas pueden ir en la misma línea
+            if opener in line or closer in line: in_code = line.rfind(opener) > line.rfind(closer)
+        elif line.lstrip().startswith(opener): in_code = not in_code
+    if current: chunks.append("\n".join(current))
+    return chunks
+
+class TelegramClient:
+    """
+    Bot API client with keep-alive connection pooling, timeouts and 429 backoff.
+    Cliente de la Bot API con conexiones persistentes, timeouts y reintentos ante 429.
+    """
+
+    def __init__(self, token, max_retries=3):
+        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.max_retries = max_retries
+        import requests.adapters
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(UPDATE_WORKERS, 4) + 2)
+        self.session.mount('https://', adapter)
+
+    def call(self, method, payload):
+        """POSTs a Bot API method and returns the decoded response ({'ok': False, ...} on failure)."""
+        with Span('telegram', method) as span:
+            data = self._post(method, payload)
+            if not data.get('ok'): span.outcome = str(data.get('error_code') or 'error')
+            return data
+
+    def _post(self, method, payload):
+        import requests
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(f"{self.base_url}/{method}", json=payload, timeout=TELEGRAM_TIMEOUT)
+            except requests.ConnectionError as e:
+                # Nothing reached Telegram, safe to retry / No llegó a Telegram, se puede reintentar
+                if attempt == self.max_retries: return {'ok': False, 'description': f"Connection Error: {e}"}
+                time.sleep(2 ** attempt * 0.5)
+                continue
+            except requests.RequestException as e:
+                return {'ok': False, 'description': f"Connection Error: {e}"}
+
+            try: data = response.json()
+            except ValueError: data = {'ok': False, 'description': f"HTTP {response.status_code}"}
+            if data.get('ok'): return data
+
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if retryable and attempt < self.max_retries:
+                retry_after = (data.get('parameters') or {}).get('retry_after')
+                delay = retry_after if retry_after is not None else 2 ** attempt * 0.5
+                logging.warning(f"⏳ Telegram {response.status_code} on {method}, retrying in {delay}s")
+                time.sleep(delay)
+                continue
+            return data
+
+    def _deliver(self, method, payload, use_markdown, parse_mode=None):
+        # Markdown rejected -> resend once as plain text / Si falla el Markdown, reenviar como texto plano
+        # Pre-escaped reports (parse_mode='MarkdownV2') should never need the retry
+        parse_mode = parse_mode or ('Markdown' if use_markdown else None)
+        if parse_mode: payload = dict(payload, parse_mode=parse_mode)
+        response_data = self.call(method, payload)
         if not response_data.get('ok'):
             error_desc = response_data.get('description', 'Unknown error')
+            if "message is not modified" in error_desc: return response_data
             logging.error(f"⚠️ Telegram Error: {error_desc}")
-            if use_markdown and ("parse" in error_desc.lower() or "markdown" in error_desc.lower()):
-                send_telegram(chat_id, text, use_markdown=False)
-    except Exception as e: logging.error(f"Connection Error: {e}")
+            if parse_mode and ("parse" in error_desc.lower() or "markdown" in error_desc.lower()):
+                payload.pop('parse_mode')
+                response_data = self.call(method, payload)
+        return response_data
+
+    def send_message(self, chat_id, text, use_markdown=True, parse_mode=None):
+        """Sends text (split if longer than 4096) and returns the response of the last chunk."""
+        response_data = None
+        for chunk in split_message(text, parse_mode=parse_mode):
+            response_data = self._deliver('sendMessage', {'chat_id': chat_id, 'text': chunk}, use_markdown, parse_mode)
+        return response_data
+
+    def edit_message(self, chat_id, message_id, text, use_markdown=True, parse_mode=None):
+        """Replaces the text of message_id; extra chunks of a long text follow as new messages."""
+        chunks = split_message(text, parse_mode=parse_mode)
+        response_data = self._deliver('editMessageText', {'chat_id': chat_id, 'message_id': message_id, 'text': chunks[0]},
+                                      use_markdown, parse_mode)
+        for chunk in chunks[1:]:
+            response_data = self._deliver('sendMessage', {'chat_id': chat_id, 'text': chunk}, use_markdown, parse_mode)
+        return response_data
+
+    def send_chat_action(self, chat_id, action='typing'):
+        return self.call('sendChatAction', {'chat_id': chat_id, 'action': action})
+
+_telegram = None
+
+def get_telegram():
+    global _telegram
+    if _telegram is None: _telegram = TelegramClient(TELEGRAM_TOKEN)
+    return _telegram
+
+def send_telegram(chat_id, text, use_markdown=True, parse_mode=None):
+    return get_telegram().send_message(chat_id, text, use_markdown, parse_mode=parse_mode)
+
+# Progress updates never block the Garmin fetches / El progreso nunca bloquea las descargas
+# Each ProgressMessage chains its own edits to keep them in order / Cada mensaje encadena sus ediciones
+# finish() drops the steps still queued, so a report never waits behind other chats' sends
+_progress_pool = ThreadPoolExecutor(max_workers=UPDATE_WORKERS, thread_name_prefix='progress')
+
+class ProgressMessage:
+    """
+    One placeholder message that is edited in place and finally replaced by the report.
+    Un solo mensaje de espera que se edita y al final se reemplaza por el reporte.
+    """
+
+    def __init__(self, chat_id, text):
+        self.chat_id = chat_id
+        self.text = text
+        self._message_id = self._last = submit_traced(_progress_pool, self._send_placeholder, text)
+        self._steps = [self._message_id]
+
+    def _send_placeholder(self, text):
+        client = get_telegram()
+        client.send_chat_action(self.chat_id)
+        response_data = client.send_message(self.chat_id, text, use_markdown=False)
+        if response_data and response_data.get('ok'): return response_data['result']['message_id']
+        return None
+
+    def _then(self, func, *args):
+        """Queues func after this message's previous step; nothing holds a pool thread while it waits."""
+        future, context = Future(), contextvars.copy_context()
+        def run():
+            # Cancelled by finish() while queued / Cancelado por finish() en la cola
+            if not future.set_running_or_notify_cancel(): return
+            try: future.set_result(context.run(func, *args))
+            except Exception as e: future.set_exception(e)
+        self._last.add_done_callback(lambda _: _progress_pool.submit(run))
+        self._last = future
+        self._steps.append(future)
+
+    def _edit(self, text):
+        message_id = self._message_id.result()
+        if message_id is not None:
+            get_telegram().edit_message(self.chat_id, message_id, text, use_markdown=False)
+
+    def update(self, text):
+        if text == self.text: return
+        self.text = text
+        self._then(self._edit, text)
+
+    def finish(self, text, use_markdown=True, parse_mode=None):
+        """Replaces the placeholder with the final text (or sends it if the placeholder failed or never went out)."""
+        # Steps not started yet are dropped; only the one already running is waited for, so the final text wins
+        wait([step for step in self._steps if not step.cancel()])
+        placeholder = self._message_id
+        message_id = None if placeholder.cancelled() or placeholder.exception() else placeholder.result()
+        if message_id is None: return send_telegram(self.chat_id, text, use_markdown, parse_mode=parse_mode)
+        return get_telegram().edit_message(self.chat_id, message_id, text, use_markdown, parse_mode=parse_mode)
 
 
 # ==============================================================================
-# MORNING REPORT LOGIC / LÓGICA DE REPORTE MATUTINO
+# USERS / USUARIOS
 # ==============================================================================
 
-def get_morning_report():
+# Who is being served: Garmin account, language and fallback timezone (hours from UTC)
+User = namedtuple('User', ['key', 'chat_id', 'email', 'password', 'lang', 'tz_offset'])
+
+# The athlete configured through env vars (single-user mode, scheduler, export script)
+DEFAULT_USER = User('default', None, GARMIN_EMAIL, GARMIN_PASSWORD, LANG_CODE, FALLBACK_OFFSET)
+
+# Copied into worker threads by submit_traced() / Se copia a los hilos con submit_traced()
+_current_user = contextvars.ContextVar('current_user', default=DEFAULT_USER)
+
+# user key -> semaphore of USER_CONCURRENCY slots
+_user_slots = {}
+
+SETTINGS_COMMANDS = {'idioma': 'lang', 'language': 'lang', 'lang': 'lang',
+                     'zona': 'tz_offset', 'timezone': 'tz_offset', 'tz': 'tz_offset'}
+
+def current_user():
+    return _current_user.get()
+
+class as_user:
+    """Everything inside `with as_user(user):` (Garmin session, T, timezone, stores) is served for that user."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def __enter__(self):
+        self._token = _current_user.set(self.user)
+        return self.user
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_user.reset(self._token)
+
+def load_user(chat_id, require_account=True):
+    """
+    User for a Telegram chat; None in multi-user mode when the chat has not linked a Garmin account.
+    require_account=False returns the chat's settings on the env user anyway: only for replies, never for Garmin calls.
+    """
+    with _db_lock:
+        row = get_db().execute("SELECT tokens, lang, tz_offset FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    lang = row[1] if row and row[1] else LANG_CODE
+    tz_offset = row[2] if row and row[2] is not None else FALLBACK_OFFSET
+    # Single-user mode: every chat is the env athlete, only the settings are per chat
+    if not MULTI_USER or not require_account: return DEFAULT_USER._replace(chat_id=chat_id, lang=lang, tz_offset=tz_offset)
+    if not row or not row[0]: return None
+    return User(f"chat:{chat_id}", chat_id, None, None, lang, tz_offset)
+
+def load_siri_user(args):
+    """User of a Siri request: the env athlete, or in multi-user mode the chat whose ?chat=&key= match."""
+    if not MULTI_USER: return DEFAULT_USER
+    try: chat_id = int(args.get('chat', ''))
+    except ValueError: return None
+    with _db_lock:
+        row = get_db().execute("SELECT siri_key FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    if not row or not row[0] or not secrets.compare_digest(row[0], args.get('key', '')): return None
+    return load_user(chat_id)
+
+def linked_users():
+    """Every user whose morning report the scheduler warms up."""
+    if not MULTI_USER: return [DEFAULT_USER]
+    with _db_lock:
+        chat_ids = [row[0] for row in get_db().execute("SELECT chat_id FROM users WHERE tokens IS NOT NULL")]
+    return [user for user in map(load_user, chat_ids) if user]
+
+def save_user_settings(chat_id, **fields):
+    with _db_lock:
+        db = get_db()
+        db.execute("INSERT OR IGNORE INTO users (chat_id, updated_at) VALUES (?, ?)", (chat_id, time.time()))
+        for field, value in fields.items():
+            db.execute(f"UPDATE users SET {field} = ?, updated_at = ? WHERE chat_id = ?", (value, time.time(), chat_id))
+        db.commit()
+
+def parse_settings_command(text):
+    """'idioma en' -> ('lang', 'en'); 'zona -6' -> ('tz_offset', -6.0); None for anything else."""
+    words = text.split()
+    if len(words) != 2 or words[0] not in SETTINGS_COMMANDS: return None
+    field, value = SETTINGS_COMMANDS[words[0]], words[1]
+    if field == 'lang': return (field, value) if value in LANGUAGES else None
+    try: offset = float(value.replace('utc', ''))
+    except ValueError: return None
+    return (field, offset) if -12 <= offset <= 14 else None
+
+def user_slot(user_key):
+    with _garmin_lock:
+        return _user_slots.setdefault(user_key, threading.BoundedSemaphore(USER_CONCURRENCY))
+
+# --- Linked Garmin accounts / Cuentas de Garmin vinculadas ---
+# Only the OAuth tokens are kept (SQLite, restored to disk on a new instance); passwords never are.
+# Point BOT_DB at persistent storage, /tmp is wiped with the instance.
+
+def user_tokenstore(user):
+    """Token directory of the user. A linked chat's tokens are restored from the database when missing."""
+    if user.key == DEFAULT_USER.key: return GARMIN_TOKENSTORE
+    path = os.path.join(GARMIN_TOKENSTORE, 'users', str(user.chat_id))
+    if not os.path.isdir(path):
+        with _db_lock:
+            row = get_db().execute("SELECT tokens FROM users WHERE chat_id = ?", (user.chat_id,)).fetchone()
+        if row and row[0]:
+            os.makedirs(path, exist_ok=True)
+            for name, content in json.loads(row[0]).items():
+                with open(os.path.join(path, os.path.basename(name)), 'w', encoding='utf-8') as f: f.write(content)
+    return path
+
+def read_tokenstore(path):
+    """{file name: content} of a token directory (whatever files the installed garminconnect writes)."""
+    files = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), encoding='utf-8') as f: files[name] = f.read()
+    return files
+
+def store_user_tokens(chat_id, files):
+    with _db_lock:
+        db = get_db()
+        db.execute("UPDATE users SET tokens = ?, updated_at = ? WHERE chat_id = ?", (json.dumps(files), time.time(), chat_id))
+        db.commit()
+
+def link_garmin_account(chat_id, email, password):
+    """Full Garmin login for a chat; only the resulting tokens are stored. Returns the reply text."""
+    load_garminconnect()
+    garmin = Garmin(email, password, return_on_mfa=True)
     try:
-        garmin = Garmin(GARMIN_EMAIL, GARMIN_PASSWORD)
-        garmin.login()
-        
-        # DYNAMIC TIMEZONE LOGIC / LÓGICA DE ZONA HORARIA DINÁMICA
-        today = get_dynamic_today(garmin)
-        
-        # 1. SLEEP
-        sleep_score, sleep_qual, sleep_secs = "-", "-", 0
-        try:
-            sleep_data = garmin.get_sleep_data(today)
-            daily_sleep = sleep_data.get('dailySleepDTO', {})
-            sleep_score = daily_sleep.get('sleepScores', {}).get('overall', {}).get('value', '-')
-            sleep_qual = daily_sleep.get('sleepScores', {}).get('overall', {}).get('qualifierKey', '').replace('_', ' ').title()
-            sleep_secs = daily_sleep.get('sleepTimeSeconds', 0)
-        except: pass
-        
-        # 2. BODY BATTERY
-        bb_charged, bb_now = "-", "-"
-        try:
-            bb_data = garmin.get_body_battery(today)
-            if bb_data:
-                values = bb_data[0].get('bodyBatteryValuesArray', [])
-                if values:
-                    vals = [x[1] for x in values if x[1] is not None]
-                    if vals: 
-                        bb_charged = max(vals) 
-                        bb_now = vals[-1]      
-        except: pass
+        with Span('garmin', 'login', mode='link'): result, _ = garmin_request(('login', chat_id), garmin.login)
+    except Exception as e:
+        logging.warning(f"⚠️ Garmin login for chat {chat_id} failed: {e}")
+        return f"{T['login_fail']}: {str(e)}"
+    if isinstance(result, tuple) and result and result[0] == 'needs_mfa': return T['login_mfa']
 
-        # 3. RHR
-        rhr = "-"
-        user_sum_data = None
-        try:
-            user_sum_data = garmin.get_user_summary(today)
-            if user_sum_data and 'restingHeartRate' in user_sum_data:
-                rhr = user_sum_data['restingHeartRate']
-        except: pass
+    path = os.path.join(GARMIN_TOKENSTORE, 'users', str(chat_id))
+    shutil.rmtree(path, ignore_errors=True)
+    _save_garmin_tokens(garmin, path)
+    with _db_lock:
+        db = get_db()
+        db.execute("INSERT OR IGNORE INTO users (chat_id, updated_at) VALUES (?, ?)", (chat_id, time.time()))
+        db.execute("UPDATE users SET siri_key = COALESCE(siri_key, ?) WHERE chat_id = ?", (secrets.token_urlsafe(16), chat_id))
+        db.commit()
+    store_user_tokens(chat_id, read_tokenstore(path))
+    # A relink may be a different athlete / Puede ser otro atleta
+    forget_user_data(f"chat:{chat_id}")
+    _pool_garmin(f"chat:{chat_id}", garmin)
+    logging.info(f"🔗 Garmin account linked for chat {chat_id}")
+    return T['login_ok']
+
+# Per-chat caches of the linked athlete / Cachés por chat del atleta vinculado
+USER_DATA_TABLES = ['morning_reports', 'history', 'daily_health', 'profiles']
+
+def forget_user_data(user_key):
+    """Drops everything cached for the athlete behind user_key (the chat may link another account next)."""
+    with _db_lock:
+        db = get_db()
+        for table in USER_DATA_TABLES:
+            db.execute(f"DELETE FROM {table} WHERE user_key = ?", (user_key,))
+        db.commit()
+    with _profiles_lock: _profiles.pop(user_key, None)
+
+def unlink_garmin_account(chat_id):
+    with _db_lock:
+        db = get_db()
+        db.execute("DELETE FROM users WHERE chat_id = ?", (chat_id,))
+        db.commit()
+    forget_user_data(f"chat:{chat_id}")
+    shutil.rmtree(os.path.join(GARMIN_TOKENSTORE, 'users', str(chat_id)), ignore_errors=True)
+    drop_garmin(f"chat:{chat_id}")
+
+def login_command(chat_id, message_id, raw_text):
+    """`login <email> <password>`: the message is deleted first so the password does not stay in the chat."""
+    if message_id is not None: get_telegram().call('deleteMessage', {'chat_id': chat_id, 'message_id': message_id})
+    parts = raw_text.split(maxsplit=2)
+    if len(parts) != 3:
+        with as_user(load_user(chat_id, require_account=False)): return send_telegram(chat_id, T['err_no_account'])
+    with as_user(load_user(chat_id, require_account=False)), Span('command', 'login', source='telegram'):
+        send_telegram(chat_id, link_garmin_account(chat_id, parts[1], parts[2]))
+
+
+# ==============================================================================
+# GARMIN GATEWAY / PASARELA DE GARMIN
+# ==============================================================================
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up. acquire() blocks until its token is there."""
 
-        # 4. TRAINING READINESS
-        readiness = "-"
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Takes one token; returns the seconds spent waiting for it."""
+        if self.rate <= 0: return 0.0
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            # A negative balance is a reservation: waiters queue up instead of racing
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait: time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Nobody gets a token for `seconds` (Garmin answered 429 to someone)."""
+        if self.rate <= 0: return
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+_garmin_bucket = TokenBucket(GARMIN_RATE, GARMIN_BURST)
+# Calls in flight by key; callers with the same key wait on the same Future
+_flights = {}
+_flights_lock = threading.Lock()
+_gateway_stats = {'throttled': 0, 'throttle_seconds': 0.0, 'retries': 0, 'shared': 0}
+
+def garmin_http_error(e):
+    """(status, Retry-After seconds) behind a Garmin error; garminconnect wraps the HTTPError in its own."""
+    for _ in range(5):
+        if e is None: break
+        if type(e).__name__ == 'GarminConnectTooManyRequestsError': return 429, None
+        response = getattr(e, 'response', None)
+        status = getattr(response, 'status_code', None)
+        if status:
+            try: retry_after = float((getattr(response, 'headers', None) or {}).get('Retry-After'))
+            except (TypeError, ValueError): retry_after = None
+            return status, retry_after
+        e = e.__cause__ or e.__context__
+    return None, None
+
+def _call_with_backoff(func, args, kwargs):
+    for attempt in range(GARMIN_RETRIES + 1):
+        waited = _garmin_bucket.acquire()
+        if waited:
+            with _metrics_lock:
+                _gateway_stats['throttled'] += 1
+                _gateway_stats['throttle_seconds'] += waited
         try:
-            r_data = garmin.get_training_readiness(today)
-            if r_data:
-                if isinstance(r_data, list) and len(r_data) > 0:
-                    readiness = r_data[0].get('score', '-')
-                elif isinstance(r_data, dict):
-                    if 'score' in r_data: readiness = r_data['score']
-                    elif 'trainingReadinessDynamicDTO' in r_data:
-                        readiness = r_data['trainingReadinessDynamicDTO'].get('score')
-        except: pass
+            return func(*args, **kwargs)
+        except Exception as e:
+            status, retry_after = garmin_http_error(e)
+            if attempt == GARMIN_RETRIES or not status or (status != 429 and status < 500): raise
+            # Full jitter keeps parallel fetches from retrying in lockstep / Jitter para no reintentar a la vez
+            if retry_after is not None: delay = min(retry_after, GARMIN_BACKOFF_MAX)
+            else: delay = random.uniform(0, min(GARMIN_BACKOFF_MAX, GARMIN_BACKOFF * 2 ** attempt))
+            if status == 429: _garmin_bucket.pause(delay)
+            logging.warning(f"⏳ Garmin {status} on {getattr(func, '__name__', func)}, retrying in {delay:.2f}s")
+            with _metrics_lock: _gateway_stats['retries'] += 1
+            time.sleep(delay)
+
+def garmin_request(key, func, *args, **kwargs):
+    """
+    The single way out to Garmin: func(*args, **kwargs) under the token bucket, retried on 429/5xx.
+    A call whose key is already in flight waits for that one instead (single-flight) and gets the
+    same answer object, so Garmin answers must be treated as read-only. Returns (result, shared).
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader: flight = _flights[key] = Future()
+    if not leader:
+        with _metrics_lock: _gateway_stats['shared'] += 1
+        return flight.result(), True
+
+    try:
+        result = _call_with_backoff(func, args, kwargs)
+        flight.set_result(result)
+        return result, False
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        with _flights_lock: del _flights[key]
+
+def get_gateway_stats():
+    with _metrics_lock: return dict(_gateway_stats, in_flight=len(_flights))
 
-        if readiness == "-" and user_sum_data:
+# ==============================================================================
+# GARMIN SESSION / SESIÓN DE GARMIN
+# ==============================================================================
+
+_import_lock = threading.Lock()
+
+def load_garminconnect():
+    """Imports garminconnect (garth, pydantic, curl_cffi...) the first time a command needs Garmin."""
+    global Garmin, GarminConnectAuthenticationError
+    with _import_lock:
+        if Garmin is None:
+            import garminconnect
+            GarminConnectAuthenticationError = garminconnect.GarminConnectAuthenticationError
+            Garmin = garminconnect.Garmin
+    return Garmin
+
+def preload_modules():
+    """Everything a Garmin command imports, at once (LAZY_IMPORTS=0 and the start-up warm-up)."""
+    load_garminconnect()
+    import requests.adapters, stream_analysis  # noqa: F401
+
+# Logged-in clients by user key, least recently used first / Clientes por usuario (LRU)
+_garmin_clients = OrderedDict()
+_garmin_lock = threading.Lock()
+# One login at a time per user; different users log in in parallel
+_login_locks = {}
+
+def _save_garmin_tokens(garmin, path):
+    # garminconnect >= 0.3 exposes .client, older (garth based) versions .garth
+    token_client = getattr(garmin, 'client', None) or getattr(garmin, 'garth', None)
+    try:
+        os.makedirs(path, exist_ok=True)
+        token_client.dump(path)
+    except Exception as e: logging.warning(f"⚠️ Could not save Garmin tokens: {e}")
+
+def _is_auth_error(e):
+    if isinstance(e, GarminConnectAuthenticationError): return True
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status == 401
+
+def _login_lock(user_key):
+    with _garmin_lock:
+        return _login_locks.setdefault(user_key, threading.Lock())
+
+def _pool_garmin(user_key, garmin):
+    client = TracedGarmin(garmin, user_key)
+    with _garmin_lock:
+        _garmin_clients[user_key] = client
+        _garmin_clients.move_to_end(user_key)
+        while len(_garmin_clients) > GARMIN_POOL_MAX:
+            evicted, _ = _garmin_clients.popitem(last=False)
+            logging.info(f"♻️ Garmin session of {evicted} dropped from the pool")
+    return client
+
+def get_garmin(force_login=False):
+    """
+    Returns the Garmin client of the current user, logging in only when needed.
+    1. Reuses the in-memory client (warm instance, GARMIN_POOL_MAX users kept).
+    2. Resumes from saved OAuth tokens (cold instance). The library refreshes them on its own.
+    3. Falls back to a full SSO login with email/password and saves the new tokens.
+       Linked chats have no stored password: they are asked to send `login` again.
+    """
+    user = current_user()
+    with _login_lock(user.key):
+        if not force_login:
+            with _garmin_lock:
+                client = _garmin_clients.get(user.key)
+                if client is not None:
+                    _garmin_clients.move_to_end(user.key)
+                    return client
+
+        tokenstore = user_tokenstore(user)
+        load_garminconnect()
+        garmin = Garmin(user.email, user.password)
+        resumed = False
+        if not force_login and os.path.isdir(tokenstore):
             try:
-                if 'trainingReadinessDynamicDTO' in user_sum_data:
-                    readiness = user_sum_data['trainingReadinessDynamicDTO'].get('score')
-                elif 'trainingReadiness' in user_sum_data:
-                    readiness = user_sum_data['trainingReadiness']
-            except: pass
-            
-        if readiness is None: readiness = "-"
+                with Span('garmin', 'login', mode='tokens'): garmin_request(('login', user.key), garmin.login, tokenstore)
+                resumed = True
+                logging.info(f"🔑 Garmin session of {user.key} resumed from tokens")
+            except Exception as e:
+                logging.warning(f"⚠️ Saved Garmin tokens rejected, logging in again. Error: {e}")
+                garmin = Garmin(user.email, user.password)
 
-        # 5. HRV
-        hrv_status, hrv_avg = "-", "-"
-        try:
-            hrv_data = garmin.get_hrv_data(today) 
-            if hrv_data and 'hrvSummary' in hrv_data:
-                summary = hrv_data['hrvSummary']
-                hrv_status = summary.get('status', '-').title()
-                hrv_avg = summary.get('weeklyAvg', '-')
-        except: pass
+        if not resumed:
+            # Linked chats keep no password / Los chats vinculados no guardan contraseña
+            if user.key != DEFAULT_USER.key: raise GarminConnectAuthenticationError(T['err_session'])
+            with Span('garmin', 'login', mode='full'): garmin_request(('login', user.key), garmin.login)
+            logging.info("🔐 Garmin full login")
 
-        msg = f"{T['morning_title']}: {today}\n\n"
-        msg += f"{T['sleep']}: {sleep_score}/100 ({sleep_qual})\n"
-        msg += f"   {T['duration']}: {format_duration_hm(sleep_secs)}\n\n"
-        msg += f"{T['body_batt']}: {T['bb_max']}: {bb_charged} | {T['bb_now']}: {bb_now}\n"
-        msg += f"{T['heart']}:\n   {T['rhr']}: {rhr} ppm\n   {T['hrv']}: {hrv_status} ({hrv_avg} ms)\n\n"
-        msg += f"{T['readiness']}: {readiness}/100\n"
-        
+        # Persist (possibly refreshed) tokens / Guardar tokens (posiblemente renovados)
+        _save_garmin_tokens(garmin, tokenstore)
+        if user.chat_id is not None and MULTI_USER: store_user_tokens(user.chat_id, read_tokenstore(tokenstore))
+        return _pool_garmin(user.key, garmin)
+
+def drop_garmin(user_key):
+    with _garmin_lock: _garmin_clients.pop(user_key, None)
+
+def with_garmin(func, *args, **kwargs):
+    """
+    Runs func(garmin, ...) with the current user's session.
+    On an authentication error the session is rebuilt with a full login and the call retried once.
+    """
+    try:
+        return func(get_garmin(), *args, **kwargs)
+    except Exception as e:
+        if not _is_auth_error(e): raise
+        logging.warning(f"⚠️ Garmin session expired, re-login. Error: {e}")
+        return func(get_garmin(force_login=True), *args, **kwargs)
+
+# Bounded pool shared by every parallel Garmin fetch / Pool acotado para descargas en paralelo
+_garmin_pool = ThreadPoolExecutor(max_workers=GARMIN_WORKERS, thread_name_prefix='garmin')
+# Fire-and-forget refreshes that may themselves call fetch_parallel()
+_background_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='background')
+
+def fetch_parallel(tasks, deadline=None):
+    """
+    Runs independent Garmin calls concurrently.
+    tasks: {name: (func, args, timeout)}. Each call's timeout counts from when a worker picks it up
+    (time queued behind other calls does not count); the global deadline counts from submission.
+    Returns {name: result}; failed or late calls map to the Exception that stopped them.
+    Never call it from inside a _garmin_pool worker (the pool is bounded).
+    """
+    start = time.monotonic()
+    started = {}
+
+    def run(name, func, *args):
+        started[name] = time.monotonic()
+        return func(*args)
+
+    futures = {name: submit_traced(_garmin_pool, run, name, func, *args) for name, (func, args, _) in tasks.items()}
+    results = {}
+    for name, future in futures.items():
+        timeout = tasks[name][2]
+        while True:
+            now = time.monotonic()
+            # Still queued: wait a full timeout and look again / En cola: esperar y volver a mirar
+            limit = started.get(name, now) + timeout
+            if deadline is not None: limit = min(limit, start + deadline)
+            try:
+                results[name] = future.result(timeout=max(0.0, limit - now))
+            except FuturesTimeout:
+                now = time.monotonic()
+                expired = deadline is not None and now >= start + deadline
+                begun = started.get(name)
+                if not expired and (begun is None or now < begun + timeout): continue
+                future.cancel()
+                results[name] = TimeoutError(f"no answer after {now - started.get(name, start):.1f}s")
+            except Exception as e: results[name] = e
+            break
+    return results
+
+def unpack_sections(results, context):
+    """Logs every failed section and replaces it with None. Auth errors are re-raised so with_garmin() can re-login."""
+    sections = {}
+    for name, value in results.items():
+        if isinstance(value, Exception):
+            if _is_auth_error(value): raise value
+            logging.warning(f"⚠️ {context}: '{name}' failed: {value!r}")
+            value = None
+        sections[name] = value
+    return sections
+
+
+# ==============================================================================
+# ACTIVITY STORE / ALMACÉN DE ACTIVIDADES
+# ==============================================================================
+
+# Finished activities barely change, so their raw JSON is kept on disk (SQLite under /tmp)
+# Las actividades terminadas casi no cambian: guardamos su JSON en disco
+_db = None
+_db_lock = threading.RLock()
+
+# (user key, list offset) -> (activityId, expires_at) / (usuario, posición) -> (activityId, expira)
+_activity_index = {}
+
+def get_db():
+    global _db
+    with _db_lock:
+        if _db is None:
+            os.makedirs(os.path.dirname(BOT_DB) or '.', exist_ok=True)
+            _db = sqlite3.connect(BOT_DB, check_same_thread=False)
+            _db.execute("PRAGMA journal_mode=WAL")
+            # Single-athlete versions of these caches had no user column: rebuild them
+            for table in ['morning_reports', 'history']:
+                columns = [row[1] for row in _db.execute(f"PRAGMA table_info({table})")]
+                if columns and 'user_key' not in columns: _db.execute(f"DROP TABLE {table}")
+            _db.execute("""CREATE TABLE IF NOT EXISTS activities (
+                activity_id INTEGER PRIMARY KEY,
+                details TEXT NOT NULL,
+                zones TEXT NOT NULL,
+                splits TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                digest TEXT,
+                stream TEXT)""")
+            _db.execute("""CREATE TABLE IF NOT EXISTS morning_reports (
+                user_key TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                day TEXT NOT NULL,
+                text TEXT NOT NULL,
+                built_at REAL NOT NULL,
+                PRIMARY KEY (user_key, lang, day))""")
+            _db.execute("""CREATE TABLE IF NOT EXISTS history (
+                user_key TEXT NOT NULL,
+                activity_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                type_key TEXT,
+                distance REAL NOT NULL,
+                duration REAL NOT NULL,
+                load REAL NOT NULL,
+                PRIMARY KEY (user_key, activity_id))""")
+            _db.execute("CREATE INDEX IF NOT EXISTS history_user_day ON history (user_key, day)")
+            # Settled days only (before yesterday): they never change / Solo días que ya no cambian
+            _db.execute("""CREATE TABLE IF NOT EXISTS daily_health (
+                user_key TEXT NOT NULL,
+                day TEXT NOT NULL,
+                sleep_score REAL,
+                rhr REAL,
+                hrv_weekly REAL,
+                bb_peak REAL,
+                PRIMARY KEY (user_key, day))""")
+            _db.execute("""CREATE TABLE IF NOT EXISTS profiles (
+                user_key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL)""")
+            _db.execute("""CREATE TABLE IF NOT EXISTS users (
+                chat_id INTEGER PRIMARY KEY,
+                tokens TEXT,
+                lang TEXT,
+                tz_offset REAL,
+                siri_key TEXT,
+                updated_at REAL NOT NULL)""")
+            columns = [row[1] for row in _db.execute("PRAGMA table_info(activities)")]
+            for column in ['digest', 'stream']:
+                if column not in columns: _db.execute(f"ALTER TABLE activities ADD COLUMN {column} TEXT")
+            _db.commit()
+        return _db
+
+def encode_payload(details, zones, splits, stream):
+    """Serializes the payloads and returns (details_json, zones_json, splits_json, stream_json, digest)."""
+    encoded = [json.dumps(details), json.dumps(zones), json.dumps(splits), json.dumps(stream)]
+    digest = hashlib.sha1("\n".join(encoded).encode('utf-8')).hexdigest()
+    return (*encoded, digest)
+
+def store_get_activity(act_id):
+    """Returns (details, zones, splits, stream, digest) or None."""
+    try:
+        with _db_lock:
+            db = get_db()
+            row = db.execute("""SELECT details, zones, splits, stream, digest FROM activities
+                WHERE activity_id = ? AND stream IS NOT NULL""", (act_id,)).fetchone()
+            if not row: return None
+            db.execute("UPDATE activities SET accessed_at = ? WHERE activity_id = ?", (time.time(), act_id))
+            db.commit()
+        return json.loads(row[0]), json.loads(row[1]), json.loads(row[2]), json.loads(row[3]), row[4]
+    except Exception as e:
+        logging.warning(f"⚠️ Activity store read failed: {e}")
+        return None
+
+def store_get_core(act_id):
+    """(details, zones, splits) of an activity stored without its stream, or None."""
+    try:
+        with _db_lock:
+            row = get_db().execute("""SELECT details, zones, splits FROM activities
+                WHERE activity_id = ? AND stream IS NULL""", (act_id,)).fetchone()
+        return tuple(json.loads(value) for value in row) if row else None
+    except Exception as e:
+        logging.warning(f"⚠️ Activity store read failed: {e}")
+        return None
+
+def store_get_digest(act_id):
+    """Digest of the stored payload without decoding it (None if not stored)."""
+    try:
+        with _db_lock:
+            row = get_db().execute("SELECT digest FROM activities WHERE activity_id = ? AND stream IS NOT NULL", (act_id,)).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logging.warning(f"⚠️ Activity store read failed: {e}")
+        return None
+
+def store_put_activity(act_id, encoded):
+    """Stores the output of encode_payload() for act_id (stream_json None = stream still to download)."""
+    try:
+        now = time.time()
+        details_json, zones_json, splits_json, stream_json, digest = encoded
+        with _db_lock:
+            db = get_db()
+            db.execute("""INSERT OR REPLACE INTO activities (activity_id, details, zones, splits, stored_at, accessed_at, digest, stream)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (act_id, details_json, zones_json, splits_json, now, now, digest, stream_json))
+            # Size-bounded eviction: keep the most recently used / Conservar las más usadas
+            db.execute("""DELETE FROM activities WHERE activity_id NOT IN (
+                SELECT activity_id FROM activities ORDER BY accessed_at DESC LIMIT ?)""", (ACTIVITY_STORE_MAX,))
+            db.commit()
+    except Exception as e: logging.warning(f"⚠️ Activity store write failed: {e}")
+
+def store_get_morning(day):
+    """Returns (text, built_at) of the current user's morning report stored for day, or None."""
+    user = current_user()
+    try:
+        with _db_lock:
+            return get_db().execute("SELECT text, built_at FROM morning_reports WHERE user_key = ? AND lang = ? AND day = ?",
+                                    (user.key, user.lang, day)).fetchone()
+    except Exception as e:
+        logging.warning(f"⚠️ Morning report read failed: {e}")
+        return None
+
+def store_put_morning(day, text):
+    user = current_user()
+    try:
+        with _db_lock:
+            db = get_db()
+            db.execute("INSERT OR REPLACE INTO morning_reports VALUES (?, ?, ?, ?, ?)", (user.key, user.lang, day, text, time.time()))
+            # Only the last week is worth keeping / Solo vale la pena guardar la última semana
+            db.execute("""DELETE FROM morning_reports WHERE user_key = ? AND day NOT IN (
+                SELECT DISTINCT day FROM morning_reports WHERE user_key = ? ORDER BY day DESC LIMIT 7)""", (user.key, user.key))
+            db.commit()
+    except Exception as e: logging.warning(f"⚠️ Morning report write failed: {e}")
+
+def invalidate_activity(act_id=None):
+    """Drops one stored activity (e.g. after editing RPE/feel) or, with no id, the whole store."""
+    with _db_lock:
+        db = get_db()
+        if act_id is None: db.execute("DELETE FROM activities")
+        else: db.execute("DELETE FROM activities WHERE activity_id = ?", (act_id,))
+        db.commit()
+    _activity_index.clear()
+
+
+# ==============================================================================
+# PROFILE SNAPSHOT / PERFIL DEL USUARIO
+# ==============================================================================
+
+# Garmin settings that rarely change. zones: HR zone floors by sport, {'DEFAULT': [z1, ..., z5], 'RUNNING': [...]}
+Profile = namedtuple('Profile', ['timezone', 'units', 'zones', 'fetched_at'])
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+# Activity type words -> sport of the Garmin zone settings (anything else uses DEFAULT)
+ZONE_SPORTS = {'running': 'RUNNING', 'cycling': 'CYCLING', 'biking': 'CYCLING', 'swimming': 'SWIMMING'}
+
+def store_get_profile(user_key):
+    with _db_lock:
+        row = get_db().execute("SELECT data FROM profiles WHERE user_key = ?", (user_key,)).fetchone()
+    return Profile(**json.loads(row[0])) if row else None
+
+def store_put_profile(user_key, profile):
+    try:
+        with _db_lock:
+            db = get_db()
+            db.execute("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                       (user_key, json.dumps(profile._asdict()), profile.fetched_at))
+            db.commit()
+    except Exception as e: logging.warning(f"⚠️ Profile write failed: {e}")
+
+def download_profile(garmin, previous=None):
+    """Settings and HR zones from Garmin. If only the zones fail, the previous zones are kept."""
+    user_data = garmin.get_user_settings().get('userData') or {}
+    zones = previous.zones if previous else {}
+    try:
+        zones = {z['sport']: [z.get(f"zone{i}Floor") for i in range(1, 6)]
+                 for z in garmin.connectapi("/biometric-service/heartRateZones") or [] if z.get('sport')}
+    except Exception as e:
+        if _is_auth_error(e): raise
+        logging.warning(f"⚠️ HR zones not available, keeping the previous ones. Error: {e}")
+    return Profile(user_data.get('timeZone'), user_data.get('measurementSystem'), zones, time.time())
+
+def get_profile(garmin, refresh=False):
+    """
+    Profile snapshot of the current user: from memory, then the local store, and from Garmin
+    once it is older than PROFILE_TTL (or refresh=True). If Garmin fails, the last snapshot is
+    returned however old it is; None only when there never was one.
+    """
+    user_key = current_user().key
+    with _profiles_lock: profile = _profiles.get(user_key)
+    if profile is None:
+        profile = store_get_profile(user_key)
+        if profile is not None:
+            with _profiles_lock: _profiles[user_key] = profile
+    if profile is not None and not refresh and time.time() - profile.fetched_at < PROFILE_TTL: return profile
+
+    try: profile = download_profile(garmin, profile)
+    except Exception as e:
+        if _is_auth_error(e): raise
+        logging.warning(f"⚠️ Profile refresh failed, using the last snapshot. Error: {e}")
+        return profile
+    with _profiles_lock: _profiles[user_key] = profile
+    store_put_profile(user_key, profile)
+    return profile
+
+def profile_zone_floors(profile, type_key):
+    """Z1..Z5 floors for the activity type: the sport's own zones, else DEFAULT, else None."""
+    if not profile or not profile.zones: return None
+    sport = next((sport for word, sport in ZONE_SPORTS.items() if word in (type_key or '')), None)
+    floors = profile.zones.get(sport) or profile.zones.get('DEFAULT')
+    return floors if floors and all(f is not None for f in floors) else None
+
+def profile_zones_key(profile):
+    """Hashable form of the zones, part of the render cache key (new zones, new labels)."""
+    return tuple(sorted((sport, tuple(floors)) for sport, floors in profile.zones.items())) if profile else None
+
+def get_profile_report(garmin, fmt=TELEGRAM_FORMAT):
+    """Profile snapshot rendered in fmt (see REPORT RENDERER); timezones like America/Mexico_City get escaped."""
+    profile = get_profile(garmin, refresh=True)
+    if profile is None: return render_text(T['err_profile'], fmt)
+    zones = "".join(render_template('profile_zone', fmt, {'sport': sport.title(), 'floors': ' / '.join(str(f) for f in floors)})
+                    for sport, floors in sorted(profile.zones.items()))
+    return render_template('profile', fmt, {'timezone': profile.timezone or '-', 'units': profile.units or '-', 'zones': zones})
+
+PROFILE_COMMANDS = ['perfil', 'profile']
+
+# ==============================================================================
+# RENDER CACHE / CACHÉ DE REPORTES
+# ==============================================================================
+
+# (activityId, language, format, payload digest) -> (expires_at, text); activityIds are unique across users
+_render_cache = OrderedDict()
+_render_lock = threading.Lock()
+_render_stats = {'hits': 0, 'misses': 0}
+
+def render_cache_get(key):
+    with _render_lock:
+        entry = _render_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            _render_cache.move_to_end(key)
+            _render_stats['hits'] += 1
+            return entry[1]
+        if entry: del _render_cache[key]
+        _render_stats['misses'] += 1
+        return None
+
+def render_cache_put(key, text):
+    with _render_lock:
+        _render_cache[key] = (time.monotonic() + RENDER_CACHE_TTL, text)
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > RENDER_CACHE_MAX: _render_cache.popitem(last=False)
+
+def get_render_stats():
+    with _render_lock:
+        return dict(_render_stats, size=len(_render_cache))
+
+
+# ==============================================================================
+# MORNING REPORT LOGIC / LÓGICA DE REPORTE MATUTINO
+# ==============================================================================
+
+def get_morning_report():
+    try: return with_garmin(get_stored_morning_report)
+    except Exception as e: return f"{T['err_morning']}: {str(e)}"
+
+def get_stored_morning_report(garmin):
+    """
+    Answers from the report stored for the user's local date (see warm_morning_report).
+    A copy older than MORNING_STALE_SECS is still returned and rebuilt in the background.
+    """
+    # DYNAMIC TIMEZONE LOGIC / LÓGICA DE ZONA HORARIA DINÁMICA
+    today = get_dynamic_today(garmin)
+    stored = store_get_morning(today)
+    if stored:
+        text, built_at = stored
+        if time.time() - built_at > MORNING_STALE_SECS: refresh_morning_in_background(today)
+        return text
+    return warm_morning_report(garmin, today)[1]
+
+def warm_morning_report(garmin, today=None):
+    """Builds the morning report and stores it once the night's sleep is available. Returns (date, text, stored)."""
+    today = today or get_dynamic_today(garmin)
+    msg, has_sleep = build_morning_report(garmin, today)
+    if has_sleep: store_put_morning(today, msg)
+    return today, msg, has_sleep
+
+_morning_refreshing = set()
+
+def refresh_morning_in_background(today):
+    key = (current_user().key, today)
+    with _db_lock:
+        if key in _morning_refreshing: return
+        _morning_refreshing.add(key)
+
+    def refresh():
+        try: with_garmin(warm_morning_report, today)
+        except Exception as e: logging.warning(f"⚠️ Morning report refresh failed: {e}")
+        finally:
+            with _db_lock: _morning_refreshing.discard(key)
+
+    # Own pool: the refresh itself uses _garmin_pool / Pool propio, el refresco usa _garmin_pool
+    submit_traced(_background_pool, refresh)
+
+def build_morning_report(garmin, today):
+    """Returns (text, has_sleep) for the given local date."""
+    # PARALLEL FETCH / DESCARGA EN PARALELO
+    # Render whatever arrived before the deadline; missing sections fall back to "-"
+    data = unpack_sections(fetch_parallel({
+        'sleep': (garmin.get_sleep_data, (today,), MORNING_SECTION_TIMEOUT),
+        'body_battery': (garmin.get_body_battery, (today,), MORNING_SECTION_TIMEOUT),
+        'user_summary': (garmin.get_user_summary, (today,), MORNING_SECTION_TIMEOUT),
+        'readiness': (garmin.get_training_readiness, (today,), MORNING_SECTION_TIMEOUT),
+        'hrv': (garmin.get_hrv_data, (today,), MORNING_SECTION_TIMEOUT),
+    }, deadline=MORNING_DEADLINE), "Morning report")
+
+    # 1. SLEEP
+    sleep_score, sleep_qual, sleep_secs = "-", "-", 0
+    try:
+        sleep_data = data['sleep']
+        daily_sleep = sleep_data.get('dailySleepDTO', {})
+        sleep_score = daily_sleep.get('sleepScores', {}).get('overall', {}).get('value', '-')
+        sleep_qual = daily_sleep.get('sleepScores', {}).get('overall', {}).get('qualifierKey', '').replace('_', ' ').title()
+        sleep_secs = daily_sleep.get('sleepTimeSeconds', 0)
+    except: pass
+
+    # 2. BODY BATTERY
+    bb_charged, bb_now = "-", "-"
+    try:
+        bb_data = data['body_battery']
+        if bb_data:
+            values = bb_data[0].get('bodyBatteryValuesArray', [])
+            if values:
+                vals = [x[1] for x in values if x[1] is not None]
+                if vals: 
+                    bb_charged = max(vals) 
+                    bb_now = vals[-1]      
+    except: pass
+
+    # 3. RHR
+    rhr = "-"
+    user_sum_data = None
+    try:
+        user_sum_data = data['user_summary']
+        if user_sum_data and 'restingHeartRate' in user_sum_data:
+            rhr = user_sum_data['restingHeartRate']
+    except: pass
+
+    # 4. TRAINING READINESS
+    readiness = "-"
+    try:
+        r_data = data['readiness']
+        if r_data:
+            if isinstance(r_data, list) and len(r_data) > 0:
+                readiness = r_data[0].get('score', '-')
+            elif isinstance(r_data, dict):
+                if 'score' in r_data: readiness = r_data['score']
+                elif 'trainingReadinessDynamicDTO' in r_data:
+                    readiness = r_data['trainingReadinessDynamicDTO'].get('score')
+    except: pass
+
+    if readiness == "-" and user_sum_data:
         try:
-            if readiness != "-":
-                r_val = int(readiness)
-                if r_val >= 85: msg += f"   {T['advice_go']}"
-                elif r_val >= 65: msg += f"   {T['advice_ok']}"
-                elif r_val >= 45: msg += f"   {T['advice_warn']}"
-                else: msg += f"   {T['advice_stop']}"
+            if 'trainingReadinessDynamicDTO' in user_sum_data:
+                readiness = user_sum_data['trainingReadinessDynamicDTO'].get('score')
+            elif 'trainingReadiness' in user_sum_data:
+                readiness = user_sum_data['trainingReadiness']
         except: pass
 
-        return msg
-    except Exception as e: return f"{T['err_morning']}: {str(e)}"
+    if readiness is None: readiness = "-"
+
+    # 5. HRV
+    hrv_status, hrv_avg = "-", "-"
+    try:
+        hrv_data = data['hrv']
+        if hrv_data and 'hrvSummary' in hrv_data:
+            summary = hrv_data['hrvSummary']
+            hrv_status = summary.get('status', '-').title()
+            hrv_avg = summary.get('weeklyAvg', '-')
+    except: pass
+
+    msg = f"{T['morning_title']}: {today}\n\n"
+    msg += f"{T['sleep']}: {sleep_score}/100 ({sleep_qual})\n"
+    msg += f"   {T['duration']}: {format_duration_hm(sleep_secs)}\n\n"
+    msg += f"{T['body_batt']}: {T['bb_max']}: {bb_charged} | {T['bb_now']}: {bb_now}\n"
+    msg += f"{T['heart']}:\n   {T['rhr']}: {rhr} ppm\n   {T['hrv']}: {hrv_status} ({hrv_avg} ms)\n\n"
+    msg += f"{T['readiness']}: {readiness}/100\n"
+
+    try:
+        if readiness != "-":
+            r_val = int(readiness)
+            if r_val >= 85: msg += f"   {T['advice_go']}"
+            elif r_val >= 65: msg += f"   {T['advice_ok']}"
+            elif r_val >= 45: msg += f"   {T['advice_warn']}"
+            else: msg += f"   {T['advice_stop']}"
+    except: pass
+
+    return msg, sleep_score not in ("-", None)
 
 
 # ==============================================================================
 # ACTIVITY LOGIC / LÓGICA DE ACTIVIDADES
 # ==============================================================================
 
-def get_activity_menu():
+def get_activity_menu(fmt=TELEGRAM_FORMAT):
+    """Last 5 activities rendered in fmt (see REPORT RENDERER); activity names are user text and get escaped."""
     try:
-        garmin = Garmin(GARMIN_EMAIL, GARMIN_PASSWORD)
-        garmin.login()
-        activities = garmin.get_activities(0, 5)
-        if not activities: return T['err_not_found']
-        
-        msg = f"{T['menu_title']}\n\n"
-        for i, act in enumerate(activities):
-            start = act.get("startTimeLocal", "")[:16].replace("T", " ")
-            name = act.get("activityName", "Sin nombre")
-            type_key = act.get("activityType", {}).get("typeKey", "activity")
-            dist_km = act.get("distance", 0) / 1000
-            msg += f"`{i}` - *{start}*\n   🏃 {type_key} | 📏 {dist_km:.2f} km\n   📝 {name}\n\n"
-        
-        msg += f"\n{T['menu_footer']}"
-        return msg
-    except Exception as e: return f"{T['err_menu']}: {str(e)}"
+        activities = with_garmin(lambda garmin: garmin.get_activities(0, 5))
+        if not activities: return render_text(T['err_not_found'], fmt)
 
-def process_report(data, zones_raw, splits_raw):
+        rows = "".join(render_template('menu_row', fmt, {
+            'i': i, 'start': act.get("startTimeLocal", "")[:16].replace("T", " "),
+            'type_key': act.get("activityType", {}).get("typeKey", "activity"),
+            'dist_km': f"{(act.get('distance') or 0) / 1000:.2f}", 'name': act.get("activityName") or "Sin nombre",
+        }) for i, act in enumerate(activities))
+        return render_template('menu', fmt, {'rows': rows})
+    except Exception as e: return render_text(f"{T['err_menu']}: {str(e)}", fmt)
+
+def resolve_activity_ids(garmin, indices):
+    """
+    Maps list offsets (0 = latest) to activityIds, None for offsets past the end.
+    Recent answers are reused for ACTIVITY_INDEX_TTL seconds; the rest is resolved
+    with a single get_activities(start, n) page.
+    """
+    now = time.monotonic()
+    user_key = current_user().key
+    ids = {}
+    for idx in indices:
+        cached = _activity_index.get((user_key, idx))
+        if cached and cached[1] > now: ids[idx] = cached[0]
+
+    missing = [idx for idx in indices if idx not in ids]
+    if missing:
+        # Only checks whether a new activity appeared / Solo revisa si apareció una actividad nueva
+        start = min(missing)
+        activities = garmin.get_activities(start, max(missing) - start + 1) or []
+        for offset, act in enumerate(activities, start):
+            _activity_index[(user_key, offset)] = (act['activityId'], now + ACTIVITY_INDEX_TTL)
+        for idx in missing:
+            ids[idx] = activities[idx - start]['activityId'] if idx - start < len(activities) else None
+            if ids[idx] is None: _activity_index.pop((user_key, idx), None)
+    return [ids[idx] for idx in indices]
+
+def resolve_activity_id(garmin, activity_index):
+    return resolve_activity_ids(garmin, [activity_index])[0]
+
+ActivityPayload = namedtuple('ActivityPayload', ['activity_id', 'details', 'zones', 'splits', 'stream', 'digest'])
+
+def fetch_stream_metrics(garmin, act_id):
+    """Downloads the per-second stream and keeps only its analysed metrics (see stream_analysis)."""
+    from stream_analysis import analyze_stream
+    return analyze_stream(garmin.get_activity_details(act_id, maxchart=STREAM_MAX_SAMPLES))
+
+def fetch_activity_by_id(garmin, act_id, keep=True):
+    """ActivityPayload for act_id, from the local store or Garmin. keep=False skips writing new downloads to the store."""
+    payload = fetch_activities_by_id(garmin, [act_id], keep)[act_id]
+    if isinstance(payload, Exception): raise payload
+    return payload
+
+def fetch_activities_by_id(garmin, act_ids, keep=True):
+    """
+    {act_id: ActivityPayload or Exception} for several activities.
+    Every missing download (details, zones, splits, stream of each activity) runs in one fetch_parallel().
+    """
+    payloads, tasks, cores = {}, {}, {}
+    for act_id in act_ids:
+        stored = store_get_activity(act_id)
+        if stored:
+            payloads[act_id] = ActivityPayload(act_id, *stored)
+            continue
+        # Stored without its stream: only the stream is downloaded / Solo falta el stream
+        core = store_get_core(act_id)
+        if core: cores[act_id] = dict(zip(['details', 'zones', 'splits'], core))
+        else:
+            # Details, zones and splits only depend on the id / Solo dependen del id -> en paralelo
+            tasks[(act_id, 'details')] = (garmin.get_activity, (act_id,), ACTIVITY_CALL_TIMEOUT)
+            tasks[(act_id, 'zones')] = (garmin.connectapi, (f"/activity-service/activity/{act_id}/hrTimeInZones",), ACTIVITY_CALL_TIMEOUT)
+            tasks[(act_id, 'splits')] = (garmin.connectapi, (f"/activity-service/activity/{act_id}/splits",), ACTIVITY_CALL_TIMEOUT)
+        tasks[(act_id, 'stream')] = (fetch_stream_metrics, (garmin, act_id), ACTIVITY_CALL_TIMEOUT)
+    if not tasks: return payloads
+
+    all_results = fetch_parallel(tasks)
+    for act_id in act_ids:
+        if act_id in payloads: continue
+        results = cores.get(act_id) or {name: all_results[(act_id, name)] for name in ['details', 'zones', 'splits']}
+        results['stream'] = all_results[(act_id, 'stream')]
+        if isinstance(results['details'], Exception):
+            payloads[act_id] = results['details']
+            continue
+        data = unpack_sections(results, f"Activity {act_id}")
+        details, zones, splits, stream = data['details'], data['zones'] or [], data['splits'] or {}, data['stream'] or {}
+
+        encoded = encode_payload(details, zones, splits, stream)
+        # Details, zones and splits are kept even when the stream failed (it is retried on the next request)
+        # Se guarda lo principal aunque falle el stream, que se reintenta después
+        stream_failed = isinstance(results['stream'], Exception)
+        core_ok = not any(isinstance(results[name], Exception) for name in ['details', 'zones', 'splits'])
+        if keep and details and core_ok and not (stream_failed and act_id in cores):
+            store_put_activity(act_id, (*encoded[:3], None, encoded[4]) if stream_failed else encoded)
+        payloads[act_id] = ActivityPayload(act_id, details, zones, splits, stream, encoded[-1])
+    return payloads
+
+def get_activity_reports(garmin, indices, refresh=False, fmt=TELEGRAM_FORMAT):
+    """
+    Reports rendered in fmt ('markdownv2', 'html', 'plain', 'json') for the activities at the given list offsets, in the same order.
+    Reports whose payload is unchanged come from the render cache; the rest are fetched together.
+    """
+    user = current_user()
+    # Zone labels need the profile; when it is due for a refresh it downloads alongside the activities
+    profile_future = submit_traced(_garmin_pool, get_profile, garmin)
+    if refresh:
+        for idx in indices: _activity_index.pop((user.key, idx), None)
+    act_ids = resolve_activity_ids(garmin, indices)
+    if refresh:
+        for act_id in act_ids:
+            if act_id is not None: invalidate_activity(act_id)
+
+    profile = profile_future.result()
+    zones_key = profile_zones_key(profile)
+    reports = {}
+    if not refresh:
+        for act_id in act_ids:
+            if act_id is None: continue
+            # The digest is read without decoding the stored JSON / Se lee sin decodificar el JSON
+            cached = render_cache_get((act_id, user.lang, fmt, zones_key, store_get_digest(act_id)))
+            if cached is not None: reports[act_id] = cached
+
+    todo = list(dict.fromkeys(a for a in act_ids if a is not None and a not in reports))
+    payloads = fetch_activities_by_id(garmin, todo) if todo else {}
+    for act_id in todo:
+        payload = payloads[act_id]
+        if isinstance(payload, Exception): raise payload
+        if not payload.details:
+            reports[act_id] = render_text(T['err_empty'], fmt)
+            continue
+        with Span('render', 'activity_report', activity_id=act_id):
+            report = render_activity(process_report(payload.details, payload.zones, payload.splits, payload.stream, profile), fmt)
+        render_cache_put((act_id, user.lang, fmt, zones_key, payload.digest), report)
+        reports[act_id] = report
+    return [reports[act_id] if act_id is not None else render_text(T['err_not_found'], fmt) for act_id in act_ids]
+
+def parse_activity_indices(spec):
+    """
+    '0' -> [0]; '0-2' -> [0, 1, 2]; '0,3' -> [0, 3]. Raises ValueError on anything else.
+    Sizes are checked before any range is built, so "0-30000000" costs nothing.
+    """
+    parts = spec.split(',')
+    if len(parts) > MULTI_ACTIVITY_MAX: raise ValueError(f"1-{MULTI_ACTIVITY_MAX} activities")
+    bounds = []
+    for part in parts:
+        part = part.strip()
+        if '-' in part: low, high = sorted(int(x) for x in part.split('-', 1))
+        else: low = high = int(part)
+        if high - low + 1 > MULTI_ACTIVITY_MAX: raise ValueError(f"1-{MULTI_ACTIVITY_MAX} activities")
+        bounds.append((low, high))
+    # A wide span would page that many activities from Garmin / Un rango amplio pediría todas esas actividades
+    if max(h for _, h in bounds) - min(l for l, _ in bounds) >= MULTI_ACTIVITY_SPAN:
+        raise ValueError(f"offsets within {MULTI_ACTIVITY_SPAN}")
+    indices = list(dict.fromkeys(i for low, high in bounds for i in range(low, high + 1)))
+    if len(indices) > MULTI_ACTIVITY_MAX: raise ValueError(f"1-{MULTI_ACTIVITY_MAX} activities")
+    return indices
+
+def parse_activity_command(text):
+    """'0-2' -> ([0, 1, 2], False); 'actualizar 0' / 'refresh 0' -> ([0], True). Raises ValueError otherwise."""
+    words = text.split(maxsplit=1)
+    if len(words) == 2 and words[0] in ['actualizar', 'recargar', 'refresh', 'reload']:
+        return parse_activity_indices(words[1]), True
+    return parse_activity_indices(text), False
+
+# ==============================================================================
+# METRIC SCHEMA / ESQUEMA DE MÉTRICAS
+# ==============================================================================
+
+# (metric, Garmin field, default when missing, converter)
+SUMMARY_FIELDS = [
+    ("distancia", "distance", 0, lambda v: safe_round(v, 2)),
+    ("duracion", "duration", 0, None),
+    ("ritmo_ms", "averageSpeed", None, None),
+    ("vel_kmh", "averageSpeed", 0, lambda v: safe_round(v * 3.6, 2)),
+    ("fc_avg", "averageHR", "N/A", safe_round),
+    ("fc_max", "maxHR", "N/A", safe_round),
+    ("te_aer", "trainingEffect", "N/A", lambda v: safe_round(v, 1)),
+    ("te_ana", "anaerobicTrainingEffect", 0.0, lambda v: safe_round(v, 1)),
+    ("carga", "activityTrainingLoad", "N/A", safe_round),
+    ("calorias", "calories", "N/A", safe_round),
+    ("cadencia", "averageRunCadence", "N/A", safe_round),
+    ("cadencia_max", "maxRunCadence", "N/A", safe_round),
+    ("zancada", "strideLength", "N/A", safe_round),
+    ("ratio_v", "verticalRatio", "N/A", lambda v: safe_round(v, 1)),
+    ("osc_v", "verticalOscillation", "N/A", lambda v: safe_round(v, 1)),
+    ("gct", "groundContactTime", "N/A", safe_round),
+    ("potencia", "averagePower", "N/A", safe_round),
+    ("ascenso", "elevationGain", 0, safe_round),
+    ("gap_ms", "avgGradeAdjustedSpeed", None, None),
+]
+
+LAP_FIELDS = [
+    ("ritmo", "averageSpeed", None, format_pace),
+    ("gap", "avgGradeAdjustedSpeed", None, format_pace),
+    ("fc", "averageHR", "-", safe_round),
+    ("cad", "averageRunCadence", "N/A", safe_round),
+    ("gct", "groundContactTime", "N/A", safe_round),
+]
+
+def compile_extractor(fields):
+    """Turns a field schema into a function that builds the metrics dict in one pass over the schema."""
+    plan = tuple((metric, field, default, convert or (lambda v: v)) for metric, field, default, convert in fields)
+
+    def extract(source):
+        get = source.get
+        return {metric: convert(get(field, default)) for metric, field, default, convert in plan}
+    return extract
+
+extract_summary = compile_extractor(SUMMARY_FIELDS)
+extract_lap = compile_extractor(LAP_FIELDS)
+
+def format_ef(value):
+    return f"{value:.2f}" if value else "-"
+
+def process_report(data, zones_raw, splits_raw, stream=None, profile=None):
     s = data.get('summaryDTO', {})
     total_duration = s.get("duration", 0)
     
@@ -356,26 +1870,8 @@ def process_report(data, zones_raw, splits_raw):
         "fecha": s.get("startTimeLocal", "").replace("T", " "),
         "lugar_completo": loc_str,
         "tipo": data.get("activityTypeDTO", {}).get("typeKey"),
-        "distancia": safe_round(s.get("distance", 0), 2),
-        "duracion": s.get("duration", 0),
-        "ritmo_ms": s.get("averageSpeed"),
-        "vel_kmh": safe_round(s.get("averageSpeed", 0) * 3.6, 2),
-        "fc_avg": safe_round(s.get("averageHR", "N/A"), 0),
-        "fc_max": safe_round(s.get("maxHR", "N/A"), 0),
-        "te_aer": safe_round(s.get("trainingEffect", "N/A"), 1),
-        "te_ana": safe_round(s.get("anaerobicTrainingEffect", 0.0), 1),
-        "carga": safe_round(s.get("activityTrainingLoad", "N/A"), 0),
-        "calorias": safe_round(s.get("calories", "N/A"), 0),
-        "cadencia": safe_round(s.get("averageRunCadence", "N/A"), 0),
-        "cadencia_max": safe_round(s.get("maxRunCadence", "N/A"), 0),
-        "zancada": safe_round(s.get("strideLength", "N/A"), 0),
-        "ratio_v": safe_round(s.get("verticalRatio", "N/A"), 1),
-        "osc_v": safe_round(s.get("verticalOscillation", "N/A"), 1),
-        "gct": safe_round(s.get("groundContactTime", "N/A"), 0),
-        "potencia": safe_round(s.get("averagePower", "N/A"), 0),
-        "ascenso": safe_round(s.get("elevationGain", 0), 0),
-        "gap_ms": s.get("avgGradeAdjustedSpeed")
     }
+    metrics.update(extract_summary(s))
     
     rpe_raw = s.get("directWorkoutRpe")
     metrics['rpe'] = safe_round(rpe_raw / 10, 0) if rpe_raw else "__"
@@ -386,24 +1882,26 @@ def process_report(data, zones_raw, splits_raw):
     else:
         metrics['feeling'] = "-"
     
-    ciq_ef = get_ciq_by_id(data, EF_APP_ID, EF_FIELD_NUM_GLOBAL)
-    metrics['ef'] = f"{ciq_ef:.2f}" if ciq_ef else "-"
+    metrics['ef'] = format_ef(ciq_index(data).get((EF_APP_ID, EF_FIELD_NUM_GLOBAL)))
     
-    zones_list = []
+    zones = []
     if zones_raw:
         zones_sorted = sorted(zones_raw, key=lambda x: x['zoneNumber'])
+        # Labels from the profile's zones; the activity's own boundaries when there is no profile
+        lows = [int(z.get('zoneLowBoundary', 0)) for z in zones_sorted]
+        floors = profile_zone_floors(profile, metrics['tipo'])
+        if floors and len(floors) == len(lows): lows = [int(f) for f in floors]
         for i, z in enumerate(zones_sorted):
             z_num = z.get('zoneNumber')
             secs = z.get('secsInZone', 0)
-            low_bound = int(z.get('zoneLowBoundary', 0))
+            low_bound = lows[i]
             if i < len(zones_sorted) - 1:
-                next_low = int(zones_sorted[i+1].get('zoneLowBoundary', 0))
-                range_str = f"{low_bound}-{next_low - 1} ppm"
+                range_str = f"{low_bound}-{lows[i+1] - 1} ppm"
             else: range_str = f">{low_bound} ppm"
             if secs > 0:
                 pct = (secs / metrics['duracion']) * 100 if metrics['duracion'] > 0 else 0
-                zones_list.append(f"  * Z{z_num} ({range_str}): {pct:.0f}% ({format_time(secs)})")
-    metrics['zonas_txt'] = "\n".join(zones_list) if zones_list else "---"
+                zones.append({'zone': z_num, 'range': range_str, 'pct': pct, 'time': format_time(secs)})
+    metrics['zones'] = zones
     
     clean_laps = []
     source_list = []
@@ -412,153 +1910,788 @@ def process_report(data, zones_raw, splits_raw):
     elif 'laps' in data and len(data['laps']) > 0:
         source_list = data['laps']
     else: source_list = data.get('splitSummaries', [])
+
+    # Classified once, not per lap / Se clasifica una vez, no por vuelta
+    skip_full_length = "splitSummaries" in str(source_list) and len(source_list) > 1
     
-    for i, split in enumerate(source_list):
+    for split in source_list:
         dist = split.get("distance", 0)
         dur = split.get("duration", 0)
         if dist < 10 and dur < 10: continue
-        if "splitSummaries" in str(source_list) and len(source_list) > 1:
-            if abs(dur - total_duration) < 2.0: continue
-        
-        clean_laps.append({
-            "nr": len(clean_laps) + 1,
-            "dist": dist,
-            "ritmo": format_pace(split.get("averageSpeed")),
-            "gap": format_pace(split.get("avgGradeAdjustedSpeed")),
-            "fc": safe_round(split.get("averageHR", "-"), 0),
-            "cad": safe_round(split.get("averageRunCadence", "N/A"), 0),
-            "gct": safe_round(split.get("groundContactTime", "N/A"), 0),
-            "ef": f"{get_ciq_by_id(split, EF_APP_ID, EF_FIELD_NUM_LAP):.2f}" if get_ciq_by_id(split, EF_APP_ID, EF_FIELD_NUM_LAP) else "-"
-        })
+        if skip_full_length and abs(dur - total_duration) < 2.0: continue
+
+        lap = {"nr": len(clean_laps) + 1, "dist": dist}
+        lap.update(extract_lap(split))
+        lap["ef"] = format_ef(ciq_index(split).get((EF_APP_ID, EF_FIELD_NUM_LAP)))
+        clean_laps.append(lap)
     metrics['laps'] = clean_laps
+
+    # PER-SECOND STREAM METRICS / MÉTRICAS DEL STREAM POR SEGUNDO
+    stream = stream or {}
+    def fmt_pct(v): return f"{v:.1f}%" if v is not None else "-"
+    metrics['ef_time'] = f"{stream['ef_time']:.2f}" if stream.get('ef_time') else "-"
+    metrics['decoupling'] = fmt_pct(stream.get('decoupling'))
+    metrics['hr_drift'] = fmt_pct(stream.get('hr_drift'))
+    metrics['best_1k'] = format_time(stream['best_1k']) if stream.get('best_1k') else "-"
+    metrics['best_5k'] = format_time(stream['best_5k']) if stream.get('best_5k') else "-"
+    metrics['has_stream'] = bool(stream)
+
+    # True km splits only add information when laps are manual / Solo si las vueltas son manuales
+    auto_km = len(clean_laps) > 1 and all(abs(l['dist'] - 1000) < 20 for l in clean_laps[:-1])
+    metrics['km_splits'] = [] if auto_km else [
+        {"km": km, "tiempo": format_time(secs), "fc": safe_round(hr, 0)}
+        for km, secs, hr in stream.get('km_splits', [])
+    ]
     return metrics
 
-def generate_markdown(m):
-    laps_table = "```\n"
-    laps_table += f"| #  | km   | {T['lbl_pace']} | {T['lbl_gap']}   | FC  | {T['lbl_cad']} | {T['lbl_gct']} | EF  |\n"
-    laps_table += "|----|------|-------|-------|-----|-----|-----|-----|\n"
-    
-    for l in m['laps']:
-        nr = str(l['nr']).rjust(2)
-        dist = f"{(l['dist']/1000):.2f}".rjust(4)
-        ritmo = str(l['ritmo']).center(5)
-        gap = str(l['gap']).center(5)
-        fc = str(l['fc']).rjust(3)
-        cad = str(l['cad']).rjust(3)
-        gct = str(l['gct']).rjust(3)
-        ef = str(l['ef']).rjust(4)
-        laps_table += f"| {nr} | {dist} | {ritmo} | {gap} | {fc} | {cad} | {gct} | {ef} |\n"
-    
-    laps_table += "```"
-    
-    return f"""
-# {T['rep_title']}: *{m['tipo'].upper()}*
-📅 {m['fecha']}
-📍 {m['lugar_completo']}
+# ==============================================================================
+# REPORT RENDERER / RENDERIZADO DE REPORTES
+# ==============================================================================
+
+# Templates use a neutral markup: <b>, <code> and <pre> for styles, {T.key} for labels (legacy
+# **bold** in a label becomes <b>), {key} for values ({key:spec} with a printf spec in row templates)
+# and {!key} for fragments already rendered. Each one is compiled once per language and format into a
+# printf-style string: labels and literal text are escaped at compile time, so rendering is one %
+# operation that only escapes the values.
+# Plantillas compiladas una vez por idioma y formato; al renderizar solo se escapan los valores.
+TEMPLATES = {
+    'activity': """{T.rep_title}: <b>{tipo}</b>
+📅 {fecha}
+📍 {lugar}
+
+{T.sec_main}
+{T.lbl_dist}: <code>{distancia} m</code> | {T.lbl_time}: <code>{duracion}</code>
+{T.lbl_pace}: <code>{ritmo}/km</code> | {T.lbl_gap}: <code>{gap}/km</code>
+Vel: <code>{vel_kmh} km/h</code> | {T.lbl_asc}: <code>{ascenso} m</code>
+
+{T.sec_cardio}
+FC Avg: <code>{fc_avg} ppm</code> | Max: <code>{fc_max} ppm</code>
+{T.lbl_load}: <code>{carga}</code> | TE: <code>{te_aer}</code> / <code>{te_ana}</code>
+
+{T.sec_splits}
+{!zones}
+
+{T.sec_eff} & {T.sec_dyn}
+EF: <code>{ef}</code> | {T.lbl_pow}: <code>{potencia} W</code> | {T.lbl_cal}: <code>{calorias}</code>
+{T.lbl_cad}: <code>{cadencia}</code> | {T.lbl_stride}: <code>{zancada} cm</code>
+{T.lbl_gct}: <code>{gct} ms</code> | {T.lbl_osc}: <code>{osc_v} cm</code> (<code>{ratio_v}%</code>){!stream}
+
+<pre>| #  | km   | {T.lbl_pace} | {T.lbl_gap}   | FC  | {T.lbl_cad} | {T.lbl_gct} | EF  |
+|----|------|-------|-------|-----|-----|-----|-----|{!laps}
+</pre>
+
+RPE: {rpe}/10 | {T.lbl_sens}: {feeling}""",
+    'zone_row': "  * Z{zone} ({range}): {pct:.0f}% ({time})",
+    'no_zones': "---",
+    'lap_row': "\n| {nr:2s} | {dist:4.2f} | {ritmo:5s} | {gap:5s} | {fc:3s} | {cad:3s} | {gct:3s} | {ef:4s} |",
+    'stream': """
+
+{T.sec_stream}
+EF(t): <code>{ef_time}</code> | Pa:HR: <code>{decoupling}</code> | {T.lbl_drift}: <code>{hr_drift}</code>
+{T.lbl_best} 1k: <code>{best_1k}</code> | {T.lbl_best} 5k: <code>{best_5k}</code>{!km_splits}""",
+    'km_splits': """
+{T.lbl_km_splits}
+<pre>{!rows}
+</pre>""",
+    'km_row': "{km:2s} | {tiempo:5s} | {fc:3s} ppm",
+    'menu': "{T.menu_title}\n\n{!rows}\n{T.menu_footer}",
+    'menu_row': "<code>{i}</code> - <b>{start}</b>\n   🏃 {type_key} | 📏 {dist_km} km\n   📝 {name}\n\n",
+    'profile': "{T.profile_title}\n\n{T.lbl_timezone}: <code>{timezone}</code>\n{T.lbl_units}: <code>{units}</code>\n{!zones}",
+    'profile_zone': "{T.lbl_hr_zones} ({sport}): <code>{floors}</code>\n",
+    'text': "{text}",
+}
+# Row templates (see render_rows): no styles, and the context they are escaped in
+# Plantillas de filas: sin estilos, y el contexto en el que se escapan
+ROW_TEMPLATES = {'lap_row': 'in_code', 'km_row': 'in_code', 'zone_row': 'text'}
+
+# Output formats: (bold, code, pre) wrappers and the (char, replacement) escapes of text / inside code
+# Backslash and & go first so they never escape the escapes / Primero \\ y & para no re-escapar
+_MDV2_TEXT = tuple((c, '\\' + c) for c in '\\_*[]()~`>#+-=|{}.!')
+_MDV2_CODE = (('\\', '\\\\'), ('`', '\\`'))
+_HTML = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'))
+RENDER_FORMATS = {
+    'markdownv2': {'b': ('*', '*'), 'code': ('`', '`'), 'pre': ('```\n', '```'), 'text': _MDV2_TEXT, 'in_code': _MDV2_CODE},
+    'html': {'b': ('<b>', '</b>'), 'code': ('<code>', '</code>'), 'pre': ('<pre>', '</pre>'), 'text': _HTML, 'in_code': _HTML},
+    'plain': {'b': ('', ''), 'code': ('', ''), 'pre': ('', ''), 'text': (), 'in_code': ()},
+}
+# Telegram parse_mode of each format / parse_mode de Telegram para cada formato
+PARSE_MODES = {'markdownv2': 'MarkdownV2', 'html': 'HTML', 'plain': None}
 
-{T['sec_main']}
-{T['lbl_dist']}: `{m['distancia']} m` | {T['lbl_time']}: `{format_time(m['duracion'])}`
-{T['lbl_pace']}: `{format_pace(m['ritmo_ms'])}/km` | {T['lbl_gap']}: `{format_pace(m['gap_ms'])}/km`
-Vel: `{m['vel_kmh']} km/h` | {T['lbl_asc']}: `{m['ascenso']} m`
+_TEMPLATE_TOKEN = re.compile(r'(</?(?:b|code|pre)>|\{(?:T\.|!)?\w+(?::[^{}]*)?\})')
+_LABEL_BOLD = re.compile(r'\*\*?([^*]+?)\*\*?')
+_compiled_templates = {}
 
-{T['sec_cardio']}
-FC Avg: `{m['fc_avg']} ppm` | Max: `{m['fc_max']} ppm`
-{T['lbl_load']}: `{m['carga']}` | TE: `{m['te_aer']}` / `{m['te_ana']}`
+def escape(text, escapes):
+    # str.replace() per reserved char present beats translate() with multi-char replacements
+    for char, replacement in escapes:
+        if char in text: text = text.replace(char, replacement)
+    return text
 
-{T['sec_splits']}
-{m['zonas_txt']}
+def compile_template(name, lang, fmt):
+    """
+    (printf-style string, [(escapes or None for raw fragments, value keys)], reorder) for one template.
+    Values are escaped group by group; reorder puts the escaped pieces back in slot order.
+    """
+    style = RENDER_FORMATS[fmt]
+    parts, slots, stack = [], [], []
+
+    def literal(text):
+        table = style['in_code'] if stack else style['text']
+        parts.append(escape(text, table).replace('%', '%%'))
+
+    for token in _TEMPLATE_TOKEN.split(TEMPLATES[name]):
+        if not token: continue
+        tag = re.fullmatch(r'<(/?)(b|code|pre)>', token)
+        if tag:
+            closing, kind = tag.groups()
+            parts.append(style[kind][1 if closing else 0])
+            if kind != 'b':
+                if closing: stack.pop()
+                else: stack.append(kind)
+        elif token.startswith('{T.'):
+            label = strings(lang)[token[3:-1]]
+            if stack:
+                literal(label)
+                continue
+            # Legacy **bold** inside labels / Negritas heredadas dentro de las etiquetas
+            for i, piece in enumerate(_LABEL_BOLD.split(label)):
+                if i % 2: parts.append(style['b'][0]); literal(piece); parts.append(style['b'][1])
+                elif piece: literal(piece)
+        elif token.startswith('{'):
+            key, _, spec = token[1:-1].partition(':')
+            parts.append('%' + (spec or 's'))
+            if key.startswith('!'): slots.append((key[1:], None))
+            else: slots.append((key, style['in_code'] if stack else style['text']))
+        else: literal(token)
+    groups = {}
+    for i, (key, table) in enumerate(slots):
+        group = groups.setdefault(table, ([], []))
+        group[0].append(key)
+        group[1].append(i)
+    order = [i for _, positions in groups.values() for i in positions]
+    reorder = itemgetter(*sorted(range(len(order)), key=order.__getitem__)) if len(order) > 1 else tuple
+    return "".join(parts), [(table, keys) for table, (keys, _) in groups.items()], reorder
+
+def compile_templates(lang):
+    """Compiles every template of lang in every format (instance warm-up)."""
+    for fmt in RENDER_FORMATS:
+        for name in TEMPLATES:
+            if (name, lang, fmt) not in _compiled_templates:
+                _compiled_templates[(name, lang, fmt)] = compile_template(name, lang, fmt)
+
+def get_template(name, fmt):
+    key = (name, current_user().lang, fmt)
+    compiled = _compiled_templates.get(key)
+    if compiled is None: compiled = _compiled_templates.setdefault(key, compile_template(*key))
+    return compiled
+
+def render_template(name, fmt, values):
+    template, groups, reorder = get_template(name, fmt)
+    pieces = []
+    # One escape() per table over all its values instead of one per value / Uno por tabla
+    for table, keys in groups:
+        joined = "\0".join([str(values[key]) for key in keys])
+        pieces += (escape(joined, table) if table else joined).split("\0")
+    return template % reorder(pieces)
+
+def render_rows(name, fmt, rows, sep=""):
+    """
+    Renders a row template (see ROW_TEMPLATES) once per tuple in rows, values in the order of its slots.
+    Rows are filled unescaped, so specs like {dist:4.2f} pad the real values, and the block is escaped once.
+    """
+    template = get_template(name, 'plain')[0]
+    return escape(sep.join([template % row for row in rows]), RENDER_FORMATS[fmt][ROW_TEMPLATES[name]])
+
+def render_text(text, fmt):
+    """Plain text (an error message...) escaped for fmt."""
+    return render_template('text', fmt, {'text': text}) if fmt != 'json' else json.dumps({'error': text}, ensure_ascii=False)
+
+def activity_json(m):
+    """Compact JSON of the report for LLM prompts: no decoration, laps and km splits as columns + rows."""
+    data = {k: v for k, v in m.items() if k not in ('has_stream', 'laps', 'km_splits')}
+    # pct stays raw in m so each output rounds it once / Se redondea una sola vez por salida
+    data['zones'] = [dict(z, pct=round(z['pct'], 1)) for z in m['zones']]
+    for key in ['laps', 'km_splits']:
+        if m.get(key):
+            columns = list(m[key][0])
+            data[key] = {'columns': columns, 'rows': [[row.get(c) for c in columns] for row in m[key]]}
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+def render_activity(m, fmt=TELEGRAM_FORMAT):
+    """Activity report in 'markdownv2' (Telegram), 'html', 'plain' (Siri) or 'json'."""
+    if fmt == 'json': return activity_json(m)
+
+    laps = render_rows('lap_row', fmt, [(l['nr'], l['dist'] / 1000, l['ritmo'], l['gap'], l['fc'], l['cad'], l['gct'], l['ef'])
+                                        for l in m['laps']])
+    zones = render_rows('zone_row', fmt, [(z['zone'], z['range'], z['pct'], z['time']) for z in m['zones']], "\n") \
+        or render_template('no_zones', fmt, {})
 
-{T['sec_eff']} & {T['sec_dyn']}
-EF: `{m['ef']}` | {T['lbl_pow']}: `{m['potencia']} W` | {T['lbl_cal']}: `{m['calorias']}`
-{T['lbl_cad']}: `{m['cadencia']}` | {T['lbl_stride']}: `{m['zancada']} cm`
-{T['lbl_gct']}: `{m['gct']} ms` | {T['lbl_osc']}: `{m['osc_v']} cm` (`{m['ratio_v']}%`)
+    stream = ""
+    if m.get('has_stream'):
+        km_splits = ""
+        if m['km_splits']:
+            rows = render_rows('km_row', fmt, [(k['km'], k['tiempo'], k['fc']) for k in m['km_splits']], "\n")
+            km_splits = render_template('km_splits', fmt, {'rows': rows})
+        stream = render_template('stream', fmt, dict(m, km_splits=km_splits))
 
-{laps_table}
+    return render_template('activity', fmt, dict(
+        m, tipo=(m['tipo'] or '').upper(), lugar=m['lugar_completo'], duracion=format_time(m['duracion']),
+        ritmo=format_pace(m['ritmo_ms']), gap=format_pace(m['gap_ms']), zones=zones, stream=stream, laps=laps))
 
-RPE: {m['rpe']}/10 | {T['lbl_sens']}: {m['feeling']}
+# ==============================================================================
+# TRAINING HISTORY / HISTORIAL DE ENTRENAMIENTO
+# ==============================================================================
+
+def _history_row(act):
+    return (act['activityId'], (act.get('startTimeLocal') or '')[:10], act.get('activityType', {}).get('typeKey'),
+            act.get('distance') or 0.0, act.get('duration') or 0.0, act.get('activityTrainingLoad') or 0.0)
+
+def sync_history(garmin, today):
     """
+    Brings the history table up to date and returns how many activities were added.
+    Only activities newer than the last one seen are downloaded; while filling in the last
+    HISTORY_DAYS, HISTORY_PARALLEL_PAGES pages of get_activities are pulled at once.
+    """
+    cutoff = (date.fromisoformat(today) - timedelta(days=HISTORY_DAYS)).isoformat()
+    user_key = current_user().key
+    with _db_lock:
+        db = get_db()
+        known = {row[0] for row in db.execute("SELECT activity_id FROM history WHERE user_key = ? AND day >= ?", (user_key, cutoff))}
+
+    new_rows, start, pages = [], 0, 1
+    while True:
+        results = fetch_parallel({
+            page: (garmin.get_activities, (start + page * HISTORY_PAGE, HISTORY_PAGE), ACTIVITY_CALL_TIMEOUT)
+            for page in range(pages)
+        })
+        done = False
+        for page in range(pages):
+            activities = results[page]
+            if isinstance(activities, Exception): raise activities
+            for act in activities:
+                row = _history_row(act)
+                # Newest first: stop at the first known or too old activity / Parar en la primera conocida
+                if row[0] in known or row[1] < cutoff:
+                    done = True
+                    break
+                new_rows.append((user_key, *row))
+            if done or len(activities) < HISTORY_PAGE:
+                done = True
+                break
+        if done: break
+        start += pages * HISTORY_PAGE
+        pages = HISTORY_PARALLEL_PAGES
+
+    if new_rows:
+        with _db_lock:
+            db = get_db()
+            db.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?)", new_rows)
+            db.execute("DELETE FROM history WHERE user_key = ? AND day < ?", (user_key, cutoff))
+            db.commit()
+    return len(new_rows)
+
+def build_history_report(garmin):
+    today = get_dynamic_today(garmin)
+    added = sync_history(garmin, today)
+    logging.info(f"📈 History synced, {added} new activities")
+
+    day = date.fromisoformat(today)
+    week_start = day - timedelta(days=day.weekday())
+    user_key = current_user().key
+    with _db_lock:
+        db = get_db()
+        weeks = db.execute("""SELECT date(day, 'weekday 0', '-6 days') AS week, SUM(distance), SUM(duration), SUM(load), COUNT(*)
+            FROM history WHERE user_key = ? AND day >= ? GROUP BY week ORDER BY week DESC""",
+            (user_key, (week_start - timedelta(weeks=3)).isoformat())).fetchall()
+        months = db.execute("""SELECT substr(day, 1, 7) AS month, SUM(distance), SUM(duration), SUM(load), COUNT(*)
+            FROM history WHERE user_key = ? AND day >= ? GROUP BY month ORDER BY month DESC LIMIT 3""",
+            (user_key, (day - timedelta(days=92)).isoformat())).fetchall()
+        acute = db.execute("SELECT SUM(load) FROM history WHERE user_key = ? AND day > ?",
+                           (user_key, (day - timedelta(days=7)).isoformat())).fetchone()[0] or 0
+        chronic = db.execute("SELECT SUM(load) FROM history WHERE user_key = ? AND day > ?",
+                             (user_key, (day - timedelta(days=28)).isoformat())).fetchone()[0] or 0
+
+    def line(label, dist, secs, load, count):
+        return f"`{label}`: {dist / 1000:.1f} km | {format_duration_hm(secs)} | {T['lbl_load']} {int(round(load))} ({count})\n"
+
+    msg = f"{T['load_title']}: {today}\n\n{T['sec_weeks']}\n"
+    msg += "".join(line(*w) for w in weeks) or "---\n"
+    msg += f"\n{T['sec_months']}\n"
+    msg += "".join(line(*m) for m in months) or "---\n"
+
+    # Acute:chronic workload ratio / Carga aguda (7d) vs crónica (promedio semanal de 28d)
+    acwr = acute / (chronic / 4) if chronic else None
+    msg += f"\n{T['acwr']}: {f'{acwr:.2f}' if acwr is not None else '-'}\n"
+    msg += f"   {T['lbl_load']} 7d: {int(round(acute))} | 28d/4: {int(round(chronic / 4))}\n"
+    if acwr is not None:
+        if acwr < 0.8: msg += f"   {T['acwr_low']}"
+        elif acwr <= 1.3: msg += f"   {T['acwr_ok']}"
+        elif acwr <= 1.5: msg += f"   {T['acwr_high']}"
+        else: msg += f"   {T['acwr_danger']}"
+    return msg
+
+HISTORY_COMMANDS = ['semana', 'mes', 'carga', 'week', 'month', 'load']
+
+def get_history_report():
+    try: return with_garmin(build_history_report)
+    except Exception as e: return f"{T['err_history']}: {str(e)}"
+
+
+# ==============================================================================
+# HEALTH TRENDS / TENDENCIAS DE SALUD
+# ==============================================================================
+
+TREND_DAYS = 28
+# (column, label, unit, direction): direction +1 when higher is better, -1 when lower is better
+TREND_METRICS = [
+    ('sleep_score', 'trend_sleep', '', 1),
+    ('rhr', 'trend_rhr', ' ppm', -1),
+    ('hrv_weekly', 'trend_hrv', ' ms', 1),
+    ('bb_peak', 'trend_bb', '', 1),
+]
+# 7-day average this much worse than the 28-day one counts as a warning sign
+TREND_WARN_CHANGE = 0.05
+TREND_COMMANDS = ['tendencia', 'tendencias', 'trend', 'trends']
+SPARK_BLOCKS = "▁▂▃▄▅▆▇█"
+
+def _days_by_date(rows, key, value):
+    return {row[key]: value(row) for row in rows or [] if row.get(key)}
+
+def _resting_hr_range(garmin, start, end):
+    # get_rhr_day() asks for one day; the same endpoint takes a range
+    params = {'fromDate': start, 'untilDate': end, 'metricId': 60}
+    return garmin.connectapi(f"/userstats-service/wellness/daily/{garmin.display_name}", params=params)
+
+def fetch_daily_health(garmin, start, end):
+    """
+    {day: (sleep_score, rhr, hrv_weekly, bb_peak)} from start to end with one range call per metric.
+    Returns (days, complete); complete is False when a metric could not be downloaded.
+    """
+    data = unpack_sections(fetch_parallel({
+        'sleep': (garmin.connectapi, (f"/wellness-service/stats/daily/sleep/score/{start}/{end}",), MORNING_SECTION_TIMEOUT),
+        'rhr': (_resting_hr_range, (garmin, start, end), MORNING_SECTION_TIMEOUT),
+        'hrv': (garmin.connectapi, (f"/hrv-service/hrv/daily/{start}/{end}",), MORNING_SECTION_TIMEOUT),
+        'body_battery': (garmin.get_body_battery, (start, end), MORNING_SECTION_TIMEOUT),
+    }, deadline=MORNING_DEADLINE), "Health trend")
+
+    sleep = _days_by_date(data['sleep'], 'calendarDate', lambda r: r.get('value'))
+    rhr_rows = ((data['rhr'] or {}).get('allMetrics') or {}).get('metricsMap', {}).get('WELLNESS_RESTING_HEART_RATE')
+    rhr = _days_by_date(rhr_rows, 'calendarDate', lambda r: r.get('value'))
+    hrv = _days_by_date((data['hrv'] or {}).get('hrvSummaries'), 'calendarDate', lambda r: r.get('weeklyAvg'))
+    bb = _days_by_date(data['body_battery'], 'date', lambda r: max(
+        (v[1] for v in r.get('bodyBatteryValuesArray') or [] if v[1] is not None), default=None))
+
+    days, day, last = {}, date.fromisoformat(start), date.fromisoformat(end)
+    while day <= last:
+        key = day.isoformat()
+        days[key] = (sleep.get(key), rhr.get(key), hrv.get(key), bb.get(key))
+        day += timedelta(days=1)
+    return days, all(value is not None for value in data.values())
+
+def load_daily_health(garmin, today):
+    """
+    Rows (day, sleep_score, rhr, hrv_weekly, bb_peak) for the last TREND_DAYS days, oldest first.
+    Past days never change, so days before yesterday are kept in daily_health and only the
+    missing ones plus yesterday and today (sleep and HRV still settle) are downloaded.
+    """
+    end = date.fromisoformat(today)
+    days = [(end - timedelta(days=TREND_DAYS - 1 - i)).isoformat() for i in range(TREND_DAYS)]
+    settled_before = days[-2]
+    user_key = current_user().key
+    with _db_lock:
+        rows = get_db().execute("""SELECT day, sleep_score, rhr, hrv_weekly, bb_peak FROM daily_health
+            WHERE user_key = ? AND day >= ? AND day < ?""", (user_key, days[0], settled_before)).fetchall()
+    known = {row[0]: row[1:] for row in rows}
+
+    fetch_from = next(day for day in days if day not in known)
+    fetched, complete = fetch_daily_health(garmin, fetch_from, today)
+    settled = [(user_key, day, *fetched[day]) for day in days if fetch_from <= day < settled_before]
+    # A failed metric would be cached as missing forever / Un fallo quedaría guardado para siempre
+    if complete and settled:
+        with _db_lock:
+            db = get_db()
+            db.executemany("INSERT OR REPLACE INTO daily_health VALUES (?, ?, ?, ?, ?, ?)", settled)
+            db.execute("DELETE FROM daily_health WHERE user_key = ? AND day < ?", (user_key, days[0]))
+            db.commit()
+    logging.info(f"📊 Health trend: {len(known)} cached days, {len(fetched)} downloaded")
+    return [(day, *(known.get(day) or fetched.get(day))) for day in days]
+
+def sparkline(series):
+    """▁▂▃▄▅▆▇█ scaled to the series range; missing days are '·'."""
+    import numpy as np
+    valid = ~np.isnan(series)
+    if not valid.any(): return "-"
+    lo, hi = np.nanmin(series), np.nanmax(series)
+    levels = np.zeros(series.size, dtype=int) if hi == lo else \
+        np.round((np.where(valid, series, lo) - lo) / (hi - lo) * (len(SPARK_BLOCKS) - 1)).astype(int)
+    return "".join(SPARK_BLOCKS[level] if ok else "·" for level, ok in zip(levels, valid))
+
+def build_trend_report(garmin):
+    import numpy as np
+    today = get_dynamic_today(garmin)
+    rows = load_daily_health(garmin, today)
+
+    # One row per metric, one column per day (NaN = no data) / Una fila por métrica, una columna por día
+    table = np.array([row[1:] for row in rows], dtype=float).T
+    valid = ~np.isnan(table)
+    filled = np.where(valid, table, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg7 = filled[:, -7:].sum(axis=1) / valid[:, -7:].sum(axis=1)
+        avg28 = filled.sum(axis=1) / valid.sum(axis=1)
+        change = (avg7 - avg28) / avg28
+    directions = np.array([direction for *_, direction in TREND_METRICS])
+    warnings = int(np.sum(change * directions < -TREND_WARN_CHANGE))
+
+    msg = f"{T['trend_title']}: {today}\n\n"
+    for i, (_, label, unit, _) in enumerate(TREND_METRICS):
+        a7 = f"{avg7[i]:.0f}{unit}" if not np.isnan(avg7[i]) else "-"
+        a28 = f"{avg28[i]:.0f}{unit}" if not np.isnan(avg28[i]) else "-"
+        delta = f" ({'↑' if change[i] > 0 else '↓' if change[i] < 0 else '='}{abs(change[i]) * 100:.0f}%)" if np.isfinite(change[i]) else ""
+        msg += f"{T[label]}\n`{sparkline(table[i])}`\n   7d: {a7} | 28d: {a28}{delta}\n\n"
+
+    if warnings >= 2: msg += T['trend_over']
+    elif warnings == 1: msg += T['trend_watch']
+    else: msg += T['trend_ok']
+    return msg
+
+def get_trend_report():
+    try: return with_garmin(build_trend_report)
+    except Exception as e: return f"{T['err_trend']}: {str(e)}"
+
+
+# ==============================================================================
+# UPDATE QUEUE / COLA DE UPDATES
+# ==============================================================================
+
+_update_queue = queue.Queue()
+_update_workers = []
+# user key -> deque of updates waiting for one of the user's slots, in arrival order
+_parked_updates = {}
+_seen_updates = OrderedDict()
+_updates_lock = threading.Lock()
+_update_stats = {'queued': 0, 'processed': 0, 'failed': 0, 'duplicates': 0,
+                 'job_seconds_total': 0.0, 'job_seconds_max': 0.0}
+
+def is_duplicate_update(update_id):
+    """Remembers the last SEEN_UPDATES_MAX update_ids and reports repeats."""
+    if update_id is None: return False
+    with _updates_lock:
+        if update_id in _seen_updates:
+            _update_stats['duplicates'] += 1
+            logging.info(f"♻️ Duplicate update {update_id} dropped ({_update_stats['duplicates']} total)")
+            return True
+        _seen_updates[update_id] = True
+        if len(_seen_updates) > SEEN_UPDATES_MAX: _seen_updates.popitem(last=False)
+    return False
+
+# Per-user slots only apply in multi-user mode: with one athlete every chat and Siri share a single key
+# Los slots por usuario solo aplican en modo multiusuario
+
+def acquire_user_slot(user, timeout=None):
+    """Takes one of user's USER_CONCURRENCY slots; False if none frees up within timeout."""
+    if not MULTI_USER: return True
+    return user_slot(user.key).acquire(timeout=timeout)
+
+def claim_user_slot(user, job):
+    """Takes one of user's slots for a queued update, or parks job behind the user's earlier updates and returns False."""
+    if not MULTI_USER: return True
+    with _updates_lock:
+        # Parked updates go first even if a slot is free / Los aparcados van primero
+        if not _parked_updates.get(user.key) and user_slot(user.key).acquire(blocking=False): return True
+        _parked_updates.setdefault(user.key, deque()).append(job)
+        return False
+
+def release_user_slot(user):
+    """
+    Frees one of user's slots. Every path (Siri, synchronous webhook, update worker) releases through here:
+    when the user has parked updates the slot goes straight to the oldest one, which returns to the update queue.
+    """
+    if not MULTI_USER: return
+    with _updates_lock:
+        parked = _parked_updates.get(user.key)
+        if not parked:
+            user_slot(user.key).release()
+            return
+        job = parked.popleft()
+        if not parked: del _parked_updates[user.key]
+    _update_queue.put(job)
+
+def _run_update(chat_id, text, queued_at, user=None):
+    """Serves one update (user set: a parked one that was handed a slot, see release_user_slot)."""
+    start = time.monotonic()
+    ok = True
+    try:
+        if user is None:
+            user = load_user(chat_id)
+            # The user already has USER_CONCURRENCY commands running: it waits in its own queue, other users go on
+            if user is not None and not claim_user_slot(user, (chat_id, text, queued_at, user)): return
+        handle_message(chat_id, text, user)
+    except Exception:
+        ok = False
+        logging.error(f"ERROR: {traceback.format_exc()}")
+    elapsed = time.monotonic() - start
+    with _updates_lock:
+        _update_stats['processed' if ok else 'failed'] += 1
+        _update_stats['job_seconds_total'] += elapsed
+        _update_stats['job_seconds_max'] = max(_update_stats['job_seconds_max'], elapsed)
+    logging.info(f"📨 Update '{text}' done in {elapsed:.2f}s "
+                 f"(waited {start - queued_at:.2f}s, queue depth {_update_queue.qsize()})")
+
+def _update_worker():
+    while True:
+        _run_update(*_update_queue.get())
+        _update_queue.task_done()
+
+def enqueue_update(chat_id, text):
+    with _updates_lock:
+        # Workers start lazily on the first queued update / Los workers arrancan con el primer update
+        while len(_update_workers) < UPDATE_WORKERS:
+            worker = threading.Thread(target=_update_worker, name=f"update-worker-{len(_update_workers)}", daemon=True)
+            worker.start()
+            _update_workers.append(worker)
+        _update_stats['queued'] += 1
+    _update_queue.put((chat_id, text, time.monotonic()))
+
+def get_update_stats():
+    with _updates_lock:
+        stats = dict(_update_stats)
+        stats['parked'] = sum(len(parked) for parked in _parked_updates.values())
+    stats['queue_depth'] = _update_queue.qsize()
+    stats['workers'] = len(_update_workers)
+    done = stats['processed'] + stats['failed']
+    stats['job_seconds_avg'] = round(stats['job_seconds_total'] / done, 3) if done else 0.0
+    return stats
+
+# --- INSTANCE WARM-UP / CALENTAMIENTO DE LA INSTANCIA ---
+_instance_warmup = None
+
+def _has_saved_tokens(path):
+    return os.path.isdir(path) and any(os.path.isfile(os.path.join(path, name)) for name in os.listdir(path))
+
+def warm_instance():
+    """
+    One-time warm-up of a new instance, off the request path: heavy imports, the SQLite store,
+    the default language and its report templates, the saved Garmin session (tokens only, never
+    a full login) and a kept-alive connection to Telegram.
+    """
+    started = time.perf_counter()
+    try:
+        preload_modules()
+        with _db_lock: get_db()
+        compile_templates(LANG_CODE)
+        if _has_saved_tokens(GARMIN_TOKENSTORE):
+            with trace_command('warmup', 'start'): get_garmin()
+        if TELEGRAM_TOKEN: get_telegram().call('getMe', {})
+        logging.info(f"🔥 Instance warmed up in {time.perf_counter() - started:.2f}s")
+    except Exception as e: logging.warning(f"⚠️ Instance warm-up incomplete: {e}")
+
+def start_instance_warmup():
+    """Instance-start hook (run at import with WARMUP_ON_START=1): schedules warm_instance() once."""
+    global _instance_warmup
+    with _import_lock:
+        if _instance_warmup is None: _instance_warmup = _background_pool.submit(warm_instance)
+    return _instance_warmup
+
+# --- ENTRY POINTS ---
+# Own pool: each warm-up uses _garmin_pool / Pool propio, cada precalentado usa _garmin_pool
+_warmup_pool = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix='warmup')
+
+def warm_user_morning(user):
+    try:
+        with as_user(user), trace_command('warmup', 'scheduler'): today, _, stored = with_garmin(warm_morning_report)
+        return {'user': user.key, 'date': today, 'stored': stored}
+    except Exception as e:
+        logging.error(f"ERROR: {traceback.format_exc()}")
+        return {'user': user.key, 'error': str(e)}
+
+def morning_warmup(request):
+    """
+    Scheduler target (Cloud Scheduler or cron + curl): builds and stores today's morning report.
+    Deploy it as its own function or call the webhook with ?warmup=morning; either way the request
+    must carry the WARMUP_TOKEN secret in the X-Warmup-Token header.
+    In multi-user mode the linked accounts are warmed up WARMUP_WORKERS at a time. With many of them,
+    split the work into several scheduler jobs with ?batch=<i>&batches=<n> (accounts i, i+n, i+2n...).
+    """
+    headers = {'Content-Type': 'application/json'}
+    token = request.headers.get('X-Warmup-Token') or ''
+    if not WARMUP_TOKEN or not secrets.compare_digest(token.encode(), WARMUP_TOKEN.encode()):
+        if not WARMUP_TOKEN: logging.warning("⚠️ Morning warm-up refused: WARMUP_TOKEN is not set")
+        return json.dumps({'error': 'forbidden'}), 403, headers
+    try:
+        batch, batches = int(request.args.get('batch', 0)), int(request.args.get('batches', 1))
+        if not 0 <= batch < batches: raise ValueError
+    except ValueError: return json.dumps({'error': 'bad batch'}), 400, headers
+
+    users = linked_users()[batch::batches]
+    futures = [submit_traced(_warmup_pool, warm_user_morning, user) for user in users]
+    results = [future.result() for future in futures]
+    if not MULTI_USER and results:
+        result = {k: v for k, v in results[0].items() if k != 'user'}
+        return json.dumps(result), 500 if 'error' in result else 200, headers
+    return json.dumps({'users': results}), 200, headers
 
-# --- ENTRY POINT ---
 def telegram_webhook(request):
+    if request.args.get('warmup') == 'morning': return morning_warmup(request)
+    # Prometheus scrape target / Endpoint para Prometheus
+    if request.path.rstrip('/').endswith('/metrics') or request.args.get('metrics'):
+        return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
     siri_mode = request.args.get('siri') or request.args.get('source') == 'siri'
     command_arg = request.args.get('command')
     headers = {'Content-Type': 'text/plain; charset=utf-8'}
 
     if siri_mode and command_arg:
         text = command_arg.strip().lower()
+        user = load_siri_user(request.args)
+        if user is None: return "Unknown user", 403, headers
+        # Siri commands share the user's USER_CONCURRENCY slots with Telegram / Comparten los slots
+        if not acquire_user_slot(user, USER_WAIT):
+            with as_user(user): return T['busy'], 200, headers
         try:
-            if text in ['mañana', 'morning', 'reporte', 'dia', 'report']:
-                return get_morning_report(), 200, headers
-            elif text in ['menu', 'lista', 'historial', 'list', 'history']:
-                return get_activity_menu(), 200, headers
-            else:
+            with as_user(user), trace_command(text, 'siri'):
                 try:
-                    idx = int(text)
-                    garmin = Garmin(GARMIN_EMAIL, GARMIN_PASSWORD)
-                    garmin.login()
-                    activities = garmin.get_activities(idx, 1)
-                    if not activities: return T['err_not_found'], 200, headers
-                    act_id = activities[0]['activityId']
-                    details = garmin.get_activity(act_id)
-                    try: zones = garmin.connectapi(f"/activity-service/activity/{act_id}/hrTimeInZones")
-                    except: zones = []
-                    try: splits = garmin.connectapi(f"/activity-service/activity/{act_id}/splits")
-                    except: splits = {}
-                    if details:
-                        metrics = process_report(details, zones, splits)
-                        return generate_markdown(metrics), 200, headers
-                    return T['err_empty'], 200, headers
-                except: return "Command not found", 200, headers
-        except Exception as e: return f"Siri Error: {str(e)}", 500, headers
+                    if text in ['mañana', 'morning', 'reporte', 'dia', 'report']:
+                        return get_morning_report(), 200, headers
+                    elif text in ['menu', 'lista', 'historial', 'list', 'history']:
+                        return get_activity_menu('plain'), 200, headers
+                    elif text in HISTORY_COMMANDS:
+                        return get_history_report(), 200, headers
+                    elif text in TREND_COMMANDS:
+                        return get_trend_report(), 200, headers
+                    elif text in PROFILE_COMMANDS:
+                        try: return with_garmin(get_profile_report, 'plain'), 200, headers
+                        except Exception as e: return f"{T['err_profile']}: {str(e)}", 200, headers
+                    else:
+                        try:
+                            indices, refresh = parse_activity_command(text)
+                            reports = with_garmin(get_activity_reports, indices, refresh, 'plain')
+                            return "\n\n".join(reports), 200, headers
+                        except: return "Command not found", 200, headers
+                except Exception as e: return f"Siri Error: {str(e)}", 500, headers
+        finally: release_user_slot(user)
+
+    if request.args.get('stats'):
+        stats = dict(get_update_stats(), render_cache=get_render_stats())
+        return json.dumps(stats), 200, {'Content-Type': 'application/json'}
 
     req = request.get_json(silent=True)
     if not req or 'message' not in req: return 'OK', 200
 
+    # Telegram retries slow webhooks: process each update_id once / Procesar cada update_id una sola vez
+    if is_duplicate_update(req.get('update_id')): return 'OK', 200
+
     chat_id = req['message']['chat']['id']
-    text = req['message'].get('text', '').strip().lower()
+    raw_text = req['message'].get('text', '').strip()
+    text = raw_text.lower()
 
-    if text in ['mañana', 'morning', 'buenos dias', 'reporte', 'report']:
-        send_telegram(chat_id, T['loading_vital'], use_markdown=False)
-        send_telegram(chat_id, get_morning_report())
+    # Credentials never go through the queue or the logs, whatever whitespace separates them
+    # Las credenciales no pasan por la cola ni los logs, con cualquier separador
+    words = raw_text.split(maxsplit=1)
+    if MULTI_USER and words and words[0].lower() == 'login':
+        login_command(chat_id, req['message'].get('message_id'), raw_text)
         return 'OK', 200
 
-    if text in ['menu', 'lista', 'historial', 'list', 'history']:
-        send_telegram(chat_id, T['loading_hist'], use_markdown=False)
-        send_telegram(chat_id, get_activity_menu())
+    if ASYNC_UPDATES:
+        # Acknowledge at once; a worker sends the replies / Responder ya, un worker envía los mensajes
+        enqueue_update(chat_id, text)
         return 'OK', 200
 
+    handle_message(chat_id, text)
+    return 'OK', 200
+
+def handle_message(chat_id, text, user=None):
+    """
+    Serves one command with the chat's own Garmin session, language and timezone.
+    At most USER_CONCURRENCY commands per user run at once: without a free slot within USER_WAIT
+    seconds the chat gets a "busy" reply (multi-user mode). user: already loaded, with a slot taken by the caller (update queue).
+    """
+    if user is None:
+        user = load_user(chat_id)
+        if user is None:
+            # No Garmin account yet: only settings and the login hint / Sin cuenta: solo ajustes
+            with as_user(load_user(chat_id, require_account=False)):
+                if not settings_command(chat_id, text): send_telegram(chat_id, T['err_no_account'])
+            return
+        if not acquire_user_slot(user, USER_WAIT):
+            with as_user(user): send_telegram(chat_id, T['busy'])
+            return
     try:
-        activity_index = int(text)
-        send_telegram(chat_id, T['loading_1'], use_markdown=False)
+        with as_user(user), trace_command(text, 'telegram', chat_id): dispatch_message(chat_id, text)
+    finally: release_user_slot(user)
+
+def settings_command(chat_id, text):
+    """`idioma en` / `zona -6`: saves the chat's language or fallback UTC offset. False if text is not one."""
+    setting = parse_settings_command(text)
+    if not setting: return False
+    field, value = setting
+    save_user_settings(chat_id, **{field: value})
+    with as_user(load_user(chat_id, require_account=False)):
+        send_telegram(chat_id, f"{T['settings_ok']}: `{field} = {value}`")
+    return True
+
+def dispatch_message(chat_id, text):
+    if settings_command(chat_id, text): return
+
+    if MULTI_USER and text in ['logout', 'salir']:
+        unlink_garmin_account(chat_id)
+        send_telegram(chat_id, T['logout_ok'])
+        return
+
+    if MULTI_USER and text == 'siri':
+        with _db_lock:
+            siri_key = get_db().execute("SELECT siri_key FROM users WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+        send_telegram(chat_id, f"{T['siri_info']}\n`&chat={chat_id}&key={siri_key}`")
+        return
+
+    if text in ['mañana', 'morning', 'buenos dias', 'reporte', 'report']:
+        progress = ProgressMessage(chat_id, T['loading_vital'])
+        progress.finish(get_morning_report())
+        return
+
+    if text in ['menu', 'lista', 'historial', 'list', 'history']:
+        progress = ProgressMessage(chat_id, T['loading_hist'])
+        progress.finish(get_activity_menu(), parse_mode=PARSE_MODES[TELEGRAM_FORMAT])
+        return
+
+    if text in HISTORY_COMMANDS:
+        progress = ProgressMessage(chat_id, T['loading_load'])
+        progress.finish(get_history_report())
+        return
+
+    if text in TREND_COMMANDS:
+        progress = ProgressMessage(chat_id, T['loading_trend'])
+        progress.finish(get_trend_report())
+        return
+
+    if text in PROFILE_COMMANDS:
+        progress = ProgressMessage(chat_id, T['loading_profile'])
+        try: progress.finish(with_garmin(get_profile_report), parse_mode=PARSE_MODES[TELEGRAM_FORMAT])
+        except Exception as e: progress.finish(f"{T['err_profile']}: {str(e)}", use_markdown=False)
+        return
+
+    try:
+        indices, refresh = parse_activity_command(text)
+        progress = ProgressMessage(chat_id, T['loading_1'])
         try:
-            garmin = Garmin(GARMIN_EMAIL, GARMIN_PASSWORD)
-            garmin.login()
-            send_telegram(chat_id, T['loading_2'], use_markdown=False)
-
-            activities = garmin.get_activities(activity_index, 1)
-            if not activities:
-                send_telegram(chat_id, T['err_not_found'], use_markdown=False)
-                return 'OK', 200
-            
-            act_id = activities[0]['activityId']
-            details = garmin.get_activity(act_id)
-            try: zones = garmin.connectapi(f"/activity-service/activity/{act_id}/hrTimeInZones")
-            except: zones = []
-            try: splits = garmin.connectapi(f"/activity-service/activity/{act_id}/splits")
-            except: splits = {}
-
-            if details:
-                metrics = process_report(details, zones, splits)
-                report = generate_markdown(metrics)
-                send_telegram(chat_id, report)
-            else:
-                send_telegram(chat_id, T['err_empty'], use_markdown=False)
+            get_garmin()
+            progress.update(T['loading_2'])
+
+            reports = with_garmin(get_activity_reports, indices, refresh)
+            # Placeholder becomes the first report, the rest follow in order
+            parse_mode = PARSE_MODES[TELEGRAM_FORMAT]
+            progress.finish(reports[0], parse_mode=parse_mode)
+            for report in reports[1:]: send_telegram(chat_id, report, parse_mode=parse_mode)
         except Exception as e:
             error_trace = traceback.format_exc()
             logging.error(f"ERROR: {error_trace}")
-            send_telegram(chat_id, f"🔥 Error: {str(e)}", use_markdown=False)
+            progress.finish(f"🔥 Error: {str(e)}", use_markdown=False)
             
     except ValueError:
         send_telegram(chat_id, T['help_msg'])
 
-    return 'OK', 200
\ No newline at end of file
+# ==============================================================================
+# INSTANCE START / ARRANQUE DE LA INSTANCIA
+# ==============================================================================
+if not LAZY_IMPORTS: preload_modules()
+IMPORT_SECONDS = time.perf_counter() - _import_started
+if WARMUP_ON_START: start_instance_warmup()